@@ -7,12 +7,56 @@ from plotly import graph_objects as go
 from datetime import datetime, timedelta
 import requests
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error
 import json
+import copy
 import io
-import base64
+import os
+import gzip
+import hashlib
+import bisect
+import sys
+import threading
+import time
+import uuid
+import weakref
+import cProfile
+import functools
+import marshal
+import pickle
+import pstats
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from area_matching import load_aliases
+from price_model import (
+    AREA_FEATURES, PREDICTION_COVERAGE, AreaFeatureTable, IncrementalPriceModel, enrich_with_area_features,
+    get_backend,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Loaded frames are cached and shared by every session: each session gets a shallow copy and
+# Copy-on-Write turns an in-place edit of it into a private copy instead of a change to the cache.
+# Derived frames still come from masks, column subsets and .assign() (pandas 3 always has it on)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 # إعداد الصفحة
 st.set_page_config(
@@ -28,9 +72,18 @@ API_PROPERTIES = f"{API_BASE_URL}/real-estate/properties"
 API_INSIGHTS = f"{API_BASE_URL}/real-estate/insights/market"
 API_RECOMMENDATIONS = f"{API_BASE_URL}/real-estate/recommendations"
 API_AREA_INTELLIGENCE = f"{API_BASE_URL}/real-estate/area-intelligence"
-API_PREDICT = f"{API_BASE_URL}/real-estate/predict"
+# PREDICT_URL can point Tab 3 at a local prediction_service.py instead
+API_PREDICT = os.environ.get("PREDICT_URL", f"{API_BASE_URL}/real-estate/predict")
 API_STATS = f"{API_BASE_URL}/real-estate/stats/summary"
 
+# Above this size filters go back to the API instead of the in-memory engine
+LOCAL_QUERY_MAX_ROWS = 500_000
+
+# Wire formats for the properties payload (columnar first, JSON as fallback)
+ARROW_STREAM_MIME = "application/vnd.apache.arrow.stream"
+MSGPACK_MIME = "application/x-msgpack"
+JSON_MIME = "application/json"
+
 # ========== Custom CSS ==========
 st.markdown(
     """
@@ -134,61 +187,1401 @@ st.markdown(
 )
 
 
+# ========== Profiler ==========
+# Opt-in: ?profile=1 (or DASHBOARD_PROFILE=1) times the named sections of every rerun,
+# ?profile=cprofile / ?profile=pyinstrument also profiles the whole rerun
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_ENV_VAR = "DASHBOARD_PROFILE"
+PROFILE_MODES = {"1": "timing", "true": "timing", "on": "timing", "cprofile": "cprofile", "pyinstrument": "pyinstrument"}
+# Reruns kept per section for the rolling p50/p95
+PROFILE_WINDOW = 200
+PROFILE_TOP_FUNCTIONS = 40
+
+
+class SectionTimings:
+    """آخر PROFILE_WINDOW توقيت لكل جزء، مشتركة بين كل الجلسات"""
+
+    def __init__(self, window=PROFILE_WINDOW):
+        self.window = window
+        self._samples = {}  # section -> deque of seconds
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def summary(self):
+        with self._lock:
+            samples = {name: np.array(values) * 1000 for name, values in self._samples.items()}
+        rows = [
+            {
+                "section": name,
+                "runs": len(ms),
+                "last_ms": round(ms[-1], 1),
+                "p50_ms": round(float(np.percentile(ms, 50)), 1),
+                "p95_ms": round(float(np.percentile(ms, 95)), 1),
+                "max_ms": round(float(ms.max()), 1),
+            }
+            for name, ms in samples.items()
+        ]
+        return pd.DataFrame(rows).sort_values("p95_ms", ascending=False, ignore_index=True) if rows else pd.DataFrame()
+
+
+@st.cache_resource
+def get_section_timings():
+    return SectionTimings()
+
+
+class RerunProfile:
+    """توقيت الأجزاء في rerun واحد (waterfall)، ومعاه cProfile أو pyinstrument لو اتطلب"""
+
+    def __init__(self, mode, timings):
+        self.mode = mode
+        self.timings = timings
+        self.spans = []  # (section, start offset, seconds, depth)
+        self._depth = 0
+        self.profiler = None
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif mode == "pyinstrument" and pyinstrument is not None:
+            self.profiler = pyinstrument.Profiler()
+            self.profiler.start()
+        self.started = time.perf_counter()
+        self.total = None
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        depth = self._depth
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            elapsed = time.perf_counter() - start
+            self.spans.append((name, start - self.started, elapsed, depth))
+            self.timings.add(name, elapsed)
+
+    def call(self, name, fn, *args):
+        with self.section(name):
+            return fn(*args)
+
+    def finish(self):
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+            if isinstance(self.profiler, cProfile.Profile):
+                self.profiler.disable()
+            elif self.profiler is not None:
+                self.profiler.stop()
+        return self.total
+
+
+_profile_state = threading.local()
+
+
+def profiling_mode():
+    value = st.query_params.get(PROFILE_QUERY_PARAM) or os.environ.get(PROFILE_ENV_VAR, "")
+    return PROFILE_MODES.get(str(value).strip().lower())
+
+
+def start_profile():
+    """بداية الـ rerun: profiler جديد لو الـ profiling شغال، وإلا None"""
+    mode = profiling_mode()
+    _profile_state.run = RerunProfile(mode, get_section_timings()) if mode else None
+    return _profile_state.run
+
+
+def current_profile():
+    return getattr(_profile_state, "run", None)
+
+
+def profiled(name):
+    """with profiled("section"): ... بيتوقّت الجزء لو الـ profiling شغال، ومن غير تكلفة لو مش شغال"""
+    run = current_profile()
+    return run.section(name) if run is not None else nullcontext()
+
+
+def profiled_function(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profiled(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def profile_waterfall(run):
+    spans = sorted(run.spans, key=lambda span: span[1])
+    labels = [f"{'· ' * depth}{name}" for name, _, _, depth in spans]
+    fig = go.Figure(
+        go.Bar(
+            y=labels,
+            x=[seconds * 1000 for _, _, seconds, _ in spans],
+            base=[offset * 1000 for _, offset, _, _ in spans],
+            orientation="h",
+            marker_color=["#667eea" if depth == 0 else "#a3bffa" for *_, depth in spans],
+            hovertemplate="%{y}<br>start %{base:.0f} ms<br>%{x:.1f} ms<extra></extra>",
+        )
+    )
+    fig.update_layout(
+        height=max(200, 22 * len(spans) + 60),
+        margin=dict(l=0, r=0, t=10, b=0),
+        xaxis_title="ms since rerun start",
+        yaxis=dict(autorange="reversed"),
+    )
+    return fig
+
+
+def render_profiler_panel(run):
+    """لوحة الـ profiler في الـ sidebar: waterfall للـ rerun ده و p50/p95 لكل جزء"""
+    if run is None:
+        return
+    total = run.finish()
+    _profile_state.run = None
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("## ⏱️ Profiler")
+        st.caption(f"This rerun: {total * 1000:,.0f} ms · {len(run.spans)} sections")
+        if run.spans:
+            st.plotly_chart(profile_waterfall(run), width="stretch", key="profiler_waterfall")
+        st.markdown("**Rolling timings (all sessions)**")
+        st.dataframe(run.timings.summary(), hide_index=True, width="stretch")
+
+        if isinstance(run.profiler, cProfile.Profile):
+            stats = pstats.Stats(run.profiler, stream=io.StringIO()).sort_stats("cumulative")
+            stats.print_stats(PROFILE_TOP_FUNCTIONS)
+            with st.expander("🔬 cProfile (top functions)"):
+                st.code(stats.stream.getvalue(), language=None)
+            # Same format as Profile.dump_stats, opens in snakeviz/pstats
+            st.download_button("⬇️ rerun.prof", data=marshal.dumps(stats.stats), file_name="rerun.prof",
+                               mime="application/octet-stream", key="profiler_dump")
+        elif run.profiler is not None:
+            with st.expander("🔬 pyinstrument"):
+                st.code(run.profiler.output_text(unicode=True), language=None)
+            st.download_button("⬇️ rerun.html", data=run.profiler.output_html(), file_name="rerun.html",
+                               mime="text/html", key="profiler_dump")
+        elif run.mode == "pyinstrument":
+            st.caption("pyinstrument is not installed, only section timings are shown.")
+        render_cache_metrics()
+
+
+profile_run = start_profile()
+
+
+# ========== Cache Metrics ==========
+# METRICS_PORT=9464 also serves the counters at http://127.0.0.1:9464/metrics (Prometheus text format)
+METRICS_PORT = os.environ.get("METRICS_PORT")
+
+# counter key -> (metric name, type, help)
+CACHE_METRICS = {
+    "hits": ("dashboard_cache_hits_total", "counter", "Lookups answered from the cache"),
+    "misses": ("dashboard_cache_misses_total", "counter", "Lookups that had to load the value"),
+    "evictions": ("dashboard_cache_evictions_total", "counter", "Entries dropped to stay within the cache limits"),
+    "refreshes": ("dashboard_cache_refreshes_total", "counter", "Background refreshes of stale entries"),
+    "errors": ("dashboard_cache_errors_total", "counter", "Loads that raised, never cached"),
+    "lookup_seconds": ("dashboard_cache_lookup_seconds_total", "counter", "Time spent hashing keys and looking them up"),
+    "load_seconds": ("dashboard_cache_load_seconds_total", "counter", "Time spent loading values on a miss"),
+    "entries": ("dashboard_cache_entries", "gauge", "Entries held by the cache"),
+    "bytes": ("dashboard_cache_bytes", "gauge", "Estimated memory held by the cache entries"),
+}
+
+
+class CacheMetrics:
+    """عدادات كاش واحد: hits/misses/evictions، وقت البحث والتحميل، وعدد وحجم العناصر"""
+
+    COUNTERS = ["hits", "misses", "evictions", "refreshes", "errors", "lookup_seconds", "load_seconds"]
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.values = dict.fromkeys(self.COUNTERS, 0)
+        # Set by the cache: returns its current {"entries": n, "bytes": b}
+        self.gauges = dict
+        self._lock = threading.Lock()
+
+    def add(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self.values[key] += delta
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self.values)
+        values.update(self.gauges())
+        lookups = values["hits"] + values["misses"]
+        values["hit_rate"] = values["hits"] / lookups if lookups else 0.0
+        return values
+
+
+class CacheMetricsRegistry:
+    """كل عدادات الكاش في التطبيق، وبتطلع كجدول أو Prometheus text"""
+
+    def __init__(self):
+        self._metrics = {}  # (kind, name) -> CacheMetrics
+        self._lock = threading.Lock()
+
+    def register(self, kind, name):
+        # A cache rebuilt under the same name keeps counting where the old one stopped
+        with self._lock:
+            return self._metrics.setdefault((kind, name), CacheMetrics(kind, name))
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        rows = [{"kind": m.kind, "cache": m.name, **m.snapshot()} for m in metrics]
+        return pd.DataFrame(rows)
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = []
+        for key, (metric, kind, help_text) in CACHE_METRICS.items():
+            if key not in snapshot.columns:
+                continue
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for row in snapshot[["kind", "cache", key]].dropna().itertuples(index=False):
+                lines.append(f'{metric}{{kind="{row.kind}",cache="{row.cache}"}} {float(row[2]):g}')
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource
+def get_cache_metrics():
+    return CacheMetricsRegistry()
+
+
+@st.cache_resource
+def start_metrics_server(port):
+    """سيرفر محلي صغير بيرجع /metrics، واحد للعملية كلها"""
+    registry = get_cache_metrics()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    except OSError:
+        # Another dashboard process already serves this port
+        return None
+    threading.Thread(target=server.serve_forever, name="cache-metrics", daemon=True).start()
+    return server
+
+
+def render_cache_metrics():
+    """جدول عدادات الكاش + نفس الأرقام بصيغة Prometheus"""
+    registry = get_cache_metrics()
+    with st.expander("🗄️ Cache metrics"):
+        snapshot = registry.snapshot()
+        if snapshot.empty:
+            st.caption("No cache lookups yet.")
+            return
+        for col in ("lookup_seconds", "load_seconds"):
+            snapshot[col.replace("seconds", "ms")] = (snapshot.pop(col) * 1000).round(1)
+        snapshot["hit_rate"] = snapshot["hit_rate"].round(3)
+        if "bytes" in snapshot.columns:
+            snapshot["mb"] = (snapshot.pop("bytes") / 1024 ** 2).round(2)
+        st.dataframe(snapshot, hide_index=True, width="stretch")
+        text = registry.prometheus_text()
+        st.code(text, language=None)
+        st.download_button("⬇️ metrics.prom", data=text, file_name="metrics.prom", mime="text/plain",
+                           key="cache_metrics_dump")
+
+
+if METRICS_PORT:
+    start_metrics_server(int(METRICS_PORT))
+
+
+# ========== Cache Layer ==========
+class StaleWhileRevalidateCache:
+    """كاش LRU بيرجع القيمة القديمة فورًا ويحدثها في الخلفية"""
+
+    # The returned value is the cached object itself, shared by every session: callers hand
+    # sessions a copy (FrameResourceRegistry.share for frames, copy.deepcopy for JSON)
+
+    def __init__(self, ttl, max_entries=32, max_bytes=None, retry_after=30, metrics=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.retry_after = retry_after
+        self._entries = OrderedDict()  # key -> (value, fetched_at, size)
+        self._refreshing = set()
+        self._loading = {}  # key -> Future of the cold fetch in flight
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.metrics = metrics or CacheMetrics("swr", "unnamed")
+        self.metrics.gauges = lambda: {"entries": len(self._entries), "bytes": self._total_bytes}
+
+    def get(self, key, fetch):
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                value, fetched_at, _ = entry
+                # Expired: serve the stale value, refresh once in the background
+                if time.monotonic() - fetched_at >= self.ttl and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(
+                        target=self._refresh, args=(key, fetch), daemon=True
+                    ).start()
+                self.metrics.add(hits=1, lookup_seconds=time.perf_counter() - start)
+                return value
+            # Sessions that miss while another one fetches wait for that request instead of sending their own
+            pending = self._loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._loading[key] = Future()
+        lookup = time.perf_counter() - start
+        if not owner:
+            value = pending.result()
+            self.metrics.add(hits=1, lookup_seconds=lookup)
+            return value
+        self.metrics.add(misses=1, lookup_seconds=lookup)
+
+        # Cold miss: fetch in the caller, errors propagate (to the waiters too) and are never cached
+        try:
+            value = self._load(fetch)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            pending.set_exception(e)
+            raise
+        self._store(key, value)
+        with self._lock:
+            del self._loading[key]
+        pending.set_result(value)
+        return value
+
+    def _load(self, fetch):
+        start = time.perf_counter()
+        try:
+            return fetch()
+        except Exception:
+            self.metrics.add(errors=1)
+            raise
+        finally:
+            self.metrics.add(load_seconds=time.perf_counter() - start)
+
+    def _refresh(self, key, fetch):
+        self.metrics.add(refreshes=1)
+        try:
+            value = self._load(fetch)
+        except Exception:
+            # Keep the last good value and retry after a short delay
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    retry_at = time.monotonic() - self.ttl + self.retry_after
+                    self._entries[key] = (entry[0], retry_at, entry[2])
+        else:
+            self._store(key, value)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, value):
+        size = _estimate_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[2]
+            self._entries[key] = (value, time.monotonic(), size)
+            self._total_bytes += size
+            # LRU eviction, always keeping the newest entry
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+            ):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.metrics.add(evictions=1)
+
+
+def freeze_params(params):
+    """dict -> tuple ثابت يصلح كمفتاح للكاش"""
+    return tuple(sorted((params or {}).items()))
+
+
+def _estimate_size(value, _seen=None):
+    """حجم تقريبي في الذاكرة: الـ frames والـ arrays بالظبط، والـ objects (نماذج، فهارس) بمحتواها"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return sys.getsizeof(value)
+
+    # Containers and plain objects are walked once each, so shared arrays count once
+    _seen = set() if _seen is None else _seen
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_estimate_size(k, _seen) + _estimate_size(v, _seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(_estimate_size(v, _seen) for v in value)
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + _estimate_size(vars(value), _seen)
+    # Extension objects without __dict__ (sklearn trees): their pickled size
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+@st.cache_resource
+def get_swr_cache(name, ttl, max_entries=32, max_bytes=None):
+    """كاش واحد لكل مصدر بيانات مشترك بين كل الجلسات"""
+    return StaleWhileRevalidateCache(
+        ttl=ttl, max_entries=max_entries, max_bytes=max_bytes, metrics=get_cache_metrics().register("swr", name)
+    )
+
+
+class PredictionCache:
+    """LRU لنتايج التوقع، المفتاح: المدخلات بعد التوحيد + نسخة النموذج"""
+
+    def __init__(self, max_entries=2048, ttl=None, metrics=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, stored_at, size)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.metrics = metrics or CacheMetrics("prediction", "unnamed")
+        self.metrics.gauges = lambda: {"entries": len(self._entries), "bytes": self._total_bytes}
+
+    def get(self, key, compute):
+        """بيرجع (القيمة, جت من الكاش ولا لأ)"""
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.metrics.add(hits=1, lookup_seconds=time.perf_counter() - start)
+                return entry[0], True
+        self.metrics.add(misses=1, lookup_seconds=time.perf_counter() - start)
+
+        # Errors propagate and are never cached
+        start = time.perf_counter()
+        try:
+            value = compute()
+        except Exception:
+            self.metrics.add(errors=1)
+            raise
+        finally:
+            self.metrics.add(load_seconds=time.perf_counter() - start)
+        size = _estimate_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[2]
+            self._entries[key] = (value, time.monotonic(), size)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.metrics.add(evictions=1)
+        return value, False
+
+    def stats(self):
+        return {k: v for k, v in self.metrics.snapshot().items()
+                if k in ("entries", "hits", "misses", "evictions", "hit_rate")}
+
+
+def prediction_key(source, model_version, inputs):
+    """نفس العقار بأي شكل كتابة يدي نفس المفتاح"""
+    normalized = (
+        round(float(inputs["area"]), 1),
+        int(inputs["bedrooms"]),
+        int(inputs["bathrooms"]),
+        str(inputs["location"]).strip().casefold(),
+        str(inputs["property_type"]).strip().casefold(),
+        str(inputs["payment_method"]).strip().casefold(),
+    )
+    return (source, model_version) + normalized
+
+
+@st.cache_resource
+def get_prediction_cache(name, ttl=None, max_entries=2048):
+    return PredictionCache(max_entries=max_entries, ttl=ttl, metrics=get_cache_metrics().register("prediction", name))
+
+
 # ========== API Functions ==========
-@st.cache_data(ttl=300)
+def properties_accept_header():
+    """الصيغ اللي نقدر نفكها بالترتيب المفضل"""
+    accepted = []
+    if pa is not None:
+        accepted.append(ARROW_STREAM_MIME)
+    if msgpack is not None:
+        accepted.append(f"{MSGPACK_MIME};q=0.9")
+    accepted.append(f"{JSON_MIME};q=0.5")
+    return ", ".join(accepted)
+
+
+def decode_properties_response(response):
+    """تحويل رد API العقارات إلى DataFrame حسب Content-Type"""
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+    # Arrow IPC stream decodes straight into columns
+    if content_type == ARROW_STREAM_MIME and pa is not None:
+        table = ipc.open_stream(response.content).read_all()
+        # One block per column and Arrow buffers freed as they convert: no 2x peak on load
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    # Columnar msgpack: {"properties": {"column": [values, ...], ...}}
+    if content_type == MSGPACK_MIME and msgpack is not None:
+        payload = msgpack.unpackb(response.content, raw=False)
+        columns = payload.get("properties", {}) if isinstance(payload, dict) else payload
+        return pd.DataFrame(columns)
+
+    data = response.json()
+    return pd.DataFrame(data.get("properties", []))
+
+
+class APIError(Exception):
+    """رد من API برقم حالة غير 200"""
+
+    def __init__(self, status_code):
+        super().__init__(f"API Error: {status_code}")
+        self.status_code = status_code
+
+
+def fetch_properties(params):
+    """جلب العقارات من API (بيرفع Exception لو فشل)"""
+    response = requests.get(
+        API_PROPERTIES,
+        params=params,
+        headers={"Accept": properties_accept_header()},
+        timeout=30,
+    )
+    if response.status_code != 200:
+        raise APIError(response.status_code)
+    return decode_properties_response(response)
+
+
+def fetch_json(url):
+    """جلب JSON من API (بيرفع Exception لو فشل)"""
+    response = requests.get(url, timeout=30)
+    if response.status_code != 200:
+        raise APIError(response.status_code)
+    return response.json()
+
+
+@profiled_function("api:properties")
 def load_data_from_api(filters=None):
     """تحميل البيانات من API"""
+    params = filters or {}
+    cache = get_swr_cache("properties", ttl=300, max_entries=64, max_bytes=512 * 1024 ** 2)
     try:
-        params = filters or {}
-        response = requests.get(API_PROPERTIES, params=params, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            return pd.DataFrame(data.get("properties", []))
-        else:
-            st.error(f"❌ API Error: {response.status_code}")
-            return pd.DataFrame()
+        # The content token is computed once per fetch, never by a rerun that reuses the frame
+        registry = get_frame_registry()
+        return registry.share(cache.get(freeze_params(params), lambda: registry.tag(fetch_properties(params))))
+    except APIError as e:
+        st.error(f"❌ API Error: {e.status_code}")
+        return pd.DataFrame()
     except Exception as e:
         st.warning(f"⚠️ Could not connect to API: {str(e)[:100]}")
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=3600)
+@profiled_function("api:area_intelligence")
 def load_area_intelligence():
     """تحميل بيانات ذكاء المناطق من API"""
+    cache = get_swr_cache("area_intelligence", ttl=3600)
     try:
-        response = requests.get(API_AREA_INTELLIGENCE, timeout=30)
-        if response.status_code == 200:
-            return pd.DataFrame(response.json())
-        else:
-            return pd.DataFrame()
-    except:
+        registry = get_frame_registry()
+        return registry.share(cache.get("all", lambda: registry.tag(pd.DataFrame(fetch_json(API_AREA_INTELLIGENCE)))))
+    except Exception:
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=300)
+@profiled_function("api:market_insights")
 def load_market_insights():
     """تحميل رؤى السوق من API"""
+    cache = get_swr_cache("market_insights", ttl=300)
     try:
-        response = requests.get(API_INSIGHTS, timeout=30)
-        if response.status_code == 200:
-            return response.json()
-        return {}
-    except:
+        return copy.deepcopy(cache.get("all", lambda: fetch_json(API_INSIGHTS)))
+    except Exception:
         return {}
 
 
-@st.cache_data(ttl=300)
+@profiled_function("api:stats_summary")
 def load_stats_summary():
     """تحميل الإحصائيات من API"""
+    cache = get_swr_cache("stats_summary", ttl=300)
     try:
-        response = requests.get(API_STATS, timeout=30)
-        if response.status_code == 200:
-            return response.json()
-        return {}
-    except:
+        return copy.deepcopy(cache.get("all", lambda: fetch_json(API_STATS)))
+    except Exception:
         return {}
 
 
+# ========== Local Query Engine ==========
+class PropertyQueryEngine:
+    """فلترة البيانات الكاملة في الذاكرة باستخدام فهارس جاهزة"""
+
+    # filter keys -> column, same contract as the /properties endpoint
+    RANGE_FILTERS = {"price": ("min_price", "max_price"), "area": ("min_area", "max_area")}
+    EQUALITY_FILTERS = ["state", "property_type", "bedrooms", "bathrooms", "payment_method"]
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+
+        # Sorted index per range column: range filters become two binary searches
+        self._sorted = {}
+        for col in self.RANGE_FILTERS:
+            if col in df.columns:
+                values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+                order = np.argsort(values, kind="stable")
+                self._sorted[col] = (values[order], order)
+
+        # One boolean mask per category value for equality filters
+        self._masks = {}
+        for col in self.EQUALITY_FILTERS:
+            if col in df.columns:
+                codes, uniques = pd.factorize(df[col])
+                self._masks[col] = {value: codes == i for i, value in enumerate(uniques)}
+
+    def mask(self, filters):
+        mask = np.ones(self.n_rows, dtype=bool)
+
+        for col in self.EQUALITY_FILTERS:
+            if col in filters and col in self._masks:
+                value_mask = self._masks[col].get(filters[col])
+                if value_mask is None:
+                    return np.zeros(self.n_rows, dtype=bool)
+                mask &= value_mask
+
+        for col, (min_key, max_key) in self.RANGE_FILTERS.items():
+            if col not in self._sorted or (min_key not in filters and max_key not in filters):
+                continue
+            sorted_values, order = self._sorted[col]
+            lo = np.searchsorted(sorted_values, filters.get(min_key, -np.inf), side="left")
+            hi = np.searchsorted(sorted_values, filters.get(max_key, np.inf), side="right")
+            range_mask = np.zeros(self.n_rows, dtype=bool)
+            range_mask[order[lo:hi]] = True
+            mask &= range_mask
+
+        return mask
+
+    def filter(self, df, filters):
+        if not filters:
+            return df
+        # Keep df_full's index so rows can be matched back to the text index
+        return df[self.mask(filters)]
+
+
+def data_version_token(df):
+    """hash لمحتوى البيانات (القيم والأعمدة)، بيتحسب مرة واحدة لكل نسخة محمّلة"""
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode("utf-8"))
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    except TypeError:
+        # Unhashable cells (lists, dicts): this copy only matches itself
+        digest.update(uuid.uuid4().bytes)
+    return digest.hexdigest()
+
+
+class FrameResourceRegistry:
+    """موارد مبنية مرة واحدة لكل نسخة بيانات (token المحتوى)، وبتتشال لما النسخة تخرج من الكاش"""
+
+    def __init__(self, metrics_registry=None):
+        self._frames = {}  # id(df) -> (weakref to df, token)
+        self._resources = {}  # (token, name) -> resource
+        self._sizes = {}  # (token, name) -> estimated bytes when built
+        self._building = {}  # (token, name) -> Future of the build in flight
+        self._lock = threading.Lock()
+        self._metrics_registry = metrics_registry or CacheMetricsRegistry()
+        self._metrics = {}  # resource name -> CacheMetrics
+
+    def metrics(self, name):
+        metrics = self._metrics.get(name)
+        if metrics is None:
+            metrics = self._metrics[name] = self._metrics_registry.register("frame", name)
+            metrics.gauges = lambda: {
+                "entries": sum(1 for _, n in list(self._resources) if n == name),
+                "bytes": sum(size for (_, n), size in list(self._sizes.items()) if n == name),
+            }
+        return metrics
+
+    def share(self, df):
+        """نسخة Copy-on-Write للجلسة (من غير نسخ البيانات) بنفس token الأصل، تعديلها مش بيوصل للكاش"""
+        token = self.version(df)
+        view = df.copy(deep=False)
+        frames = self._frames
+
+        def forget(ref, frame_id=id(view)):
+            if frames.get(frame_id, (None,))[0] is ref:
+                frames.pop(frame_id, None)
+
+        with self._lock:
+            self._frames[id(view)] = (weakref.ref(view, forget), token)
+        return view
+
+    def tag(self, df):
+        """يحسب token النسخة وقت التحميل (حتى في thread الـ refresh) ويرجع نفس الـ df"""
+        self.version(df)
+        return df
+
+    def version(self, df):
+        """token ثابت لمحتوى النسخة دي: نفس البيانات بعد refresh = نفس الـ token"""
+        entry = self._frames.get(id(df))
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+
+        token = data_version_token(df)
+        with self._lock:
+            self._frames[id(df)] = (weakref.ref(df), token)
+            # Resources of data versions no loaded frame carries any more are evicted with them
+            live = set()
+            for frame_id, (ref, frame_token) in list(self._frames.items()):
+                if ref() is None:
+                    del self._frames[frame_id]
+                else:
+                    live.add(frame_token)
+            for stale in [key for key in self._resources if key[0] not in live]:
+                del self._resources[stale]
+                self._sizes.pop(stale, None)
+                self.metrics(stale[1]).add(evictions=1)
+        return token
+
+    def get(self, df, name, build):
+        start = time.perf_counter()
+        metrics = self.metrics(name)
+        key = (self.version(df), name)
+        with self._lock:
+            if key in self._resources:
+                metrics.add(hits=1, lookup_seconds=time.perf_counter() - start)
+                return self._resources[key]
+            # Sessions that ask while the first one builds wait for that build instead of repeating it
+            pending = self._building.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._building[key] = Future()
+        lookup = time.perf_counter() - start
+        if not owner:
+            resource = pending.result()
+            metrics.add(hits=1, lookup_seconds=lookup)
+            return resource
+        metrics.add(misses=1, lookup_seconds=lookup)
+
+        start = time.perf_counter()
+        try:
+            resource = build(df)
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            pending.set_exception(e)
+            raise
+        finally:
+            metrics.add(load_seconds=time.perf_counter() - start)
+        size = _estimate_size(resource)
+        with self._lock:
+            self._resources[key] = resource
+            self._sizes[key] = size
+            del self._building[key]
+        pending.set_result(resource)
+        return resource
+
+
+@st.cache_resource
+def get_frame_registry():
+    return FrameResourceRegistry(get_cache_metrics())
+
+
+def load_area_features():
+    """جدول خصائص المناطق، بيتبني مرة واحدة لكل نسخة من بيانات المناطق"""
+    return get_frame_registry().get(
+        load_area_intelligence(), "area_feature_table", lambda area_df: AreaFeatureTable(area_df, load_aliases())
+    )
+
+
+def uses_local_engine(df_full):
+    return not df_full.empty and len(df_full) <= LOCAL_QUERY_MAX_ROWS
+
+
+def query_properties(df_full, filters):
+    """فلترة محلية على df_full، والـ API بس للبيانات الكبيرة جدًا"""
+    if not uses_local_engine(df_full):
+        return load_data_from_api(filters)
+    engine = get_frame_registry().get(df_full, "query_engine", PropertyQueryEngine)
+    return engine.filter(df_full, filters)
+
+
+# ========== Text Search Index ==========
+ARABIC_DIACRITICS = "\u064b\u064c\u064d\u064e\u064f\u0650\u0651\u0652\u0640"
+
+# Unify spelling variants, drop diacritics/tatweel and turn punctuation into spaces
+_SEARCH_NORMALIZE_TABLE = str.maketrans(
+    {
+        **{c: "" for c in ARABIC_DIACRITICS},
+        **{c: "ا" for c in "أإآٱ"},
+        "ى": "ي",
+        "ؤ": "و",
+        "ئ": "ي",
+        **{c: " " for c in ",.-_/()[]{}|'\"!?:;&+"},
+    }
+)
+
+# Arabic letters -> rough Latin sound, Egyptian style (ج = g, ق = k)
+_ARABIC_TO_LATIN = {
+    "ا": "a", "ب": "b", "ت": "t", "ث": "s", "ج": "g", "ح": "h", "خ": "k",
+    "د": "d", "ذ": "z", "ر": "r", "ز": "z", "س": "s", "ش": "s", "ص": "s",
+    "ض": "d", "ط": "t", "ظ": "z", "ع": "a", "غ": "g", "ف": "f", "ق": "k",
+    "ك": "k", "ل": "l", "م": "m", "ن": "n", "ه": "h", "ة": "", "و": "w",
+    "ي": "y", "ء": "",
+}
+
+# Latin spellings that sound the same collapse to one letter
+_LATIN_DIGRAPHS = [("kh", "k"), ("gh", "g"), ("sh", "s"), ("ch", "s"), ("th", "t"), ("dh", "d"), ("ph", "f")]
+_LATIN_SOUNDS = str.maketrans({"q": "k", "c": "k", "j": "g", "p": "b", "v": "f", "x": "k"})
+_SKELETON_VOWELS = set("aeiouwy")
+
+# Short place words whose two-letter skeleton is too common to match across scripts
+_SHORT_TRANSLITERATIONS = {
+    "sidi": ["سيدي"], "san": ["سان"], "abu": ["ابو"], "abou": ["ابو"], "bab": ["باب"],
+    "سيدي": ["sidi"], "سان": ["san"], "ابو": ["abu", "abou"], "باب": ["bab"],
+}
+
+
+def normalize_search_text(text):
+    return text.lower().translate(_SEARCH_NORMALIZE_TABLE)
+
+
+def phonetic_skeleton(token):
+    """مفتاح صوتي مشترك للكتابة العربي والإنجليزي (سموحة = smouha = smh)"""
+    if token.startswith("ال") and len(token) > 3:
+        token = token[2:]
+    if token.endswith("ه") and len(token) > 2:
+        token = token[:-1]
+    latin = "".join(_ARABIC_TO_LATIN.get(ch, ch) for ch in token)
+    for digraph, sound in _LATIN_DIGRAPHS:
+        latin = latin.replace(digraph, sound)
+    latin = latin.translate(_LATIN_SOUNDS)
+
+    # A leading vowel is kept as "a" so "abdo" does not collide with "bed"
+    skeleton = ["a"] if latin[:1] in ("a", "e", "i", "o", "u") else []
+    for ch in latin:
+        if ch in _SKELETON_VOWELS or not ch.isalnum():
+            continue
+        if not skeleton or skeleton[-1] != ch:
+            skeleton.append(ch)
+    return "".join(skeleton)
+
+
+def _is_arabic(token):
+    return any("\u0600" <= ch <= "\u06ff" for ch in token)
+
+
+def _trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PropertyTextIndex:
+    """فهرس مقلوب للكلمات في العنوان والمنطقة والحي"""
+
+    COLUMNS = ["title", "location", "state"]
+    FUZZY_THRESHOLD = 0.5
+
+    def __init__(self, df):
+        positions = np.arange(len(df))
+        self._rows = len(df)
+        pairs = []
+        for col in self.COLUMNS:
+            if col in df.columns:
+                tokens = (
+                    pd.Series(df[col].astype("string").fillna("").to_numpy(), index=positions)
+                    .str.lower()
+                    .str.translate(_SEARCH_NORMALIZE_TABLE)
+                    .str.split()
+                    .explode()
+                    .dropna()
+                )
+                pairs.append(tokens)
+
+        if pairs:
+            token_rows = pd.concat(pairs)
+            token_rows = token_rows[token_rows != ""]
+            postings = token_rows.groupby(token_rows.values).groups
+        else:
+            postings = {}
+
+        # token -> sorted row positions
+        self._postings = {
+            token: np.unique(np.asarray(rows, dtype=np.int64)) for token, rows in postings.items()
+        }
+        self._vocabulary = sorted(self._postings)
+
+        self._skeletons = {}
+        self._trigram_index = {}
+        for token in self._vocabulary:
+            self._skeletons.setdefault(phonetic_skeleton(token), []).append(token)
+            for gram in _trigrams(token):
+                self._trigram_index.setdefault(gram, []).append(token)
+
+    def _prefix_matches(self, token):
+        start = bisect.bisect_left(self._vocabulary, token)
+        end = bisect.bisect_left(self._vocabulary, token + "\uffff")
+        return self._vocabulary[start:end]
+
+    def _fuzzy_matches(self, token):
+        grams = _trigrams(token)
+        overlap = {}
+        for gram in grams:
+            for candidate in self._trigram_index.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+        return [
+            candidate for candidate, shared in overlap.items()
+            if shared / len(grams | _trigrams(candidate)) >= self.FUZZY_THRESHOLD
+        ]
+
+    def matching_tokens(self, token):
+        matches = set(self._prefix_matches(token))
+
+        # Same-sounding tokens across scripts (سموحة <-> smouha) and spelling
+        # variants (smoha, semouha). Two-letter keys are too common to cross scripts
+        # ("sidi" = السداد = السعودية = sd), so they only catch same-script variants
+        skeleton = phonetic_skeleton(token)
+        if len(skeleton) >= 2:
+            token_is_arabic = _is_arabic(token)
+            for candidate in self._skeletons.get(skeleton, ()):
+                if len(skeleton) >= 3 or (not matches and _is_arabic(candidate) == token_is_arabic):
+                    matches.add(candidate)
+            matches.update(t for t in _SHORT_TRANSLITERATIONS.get(token, ()) if t in self._postings)
+
+        if not matches and len(token) >= 3:
+            matches.update(self._fuzzy_matches(token))
+        return matches
+
+    def search(self, query):
+        """أرقام الصفوف (positions) اللي فيها كل كلمات البحث، والبحث من غير كلمات بيرجع كل الصفوف"""
+        result = None
+        for token in normalize_search_text(query).split():
+            tokens = self.matching_tokens(token)
+            if not tokens:
+                return np.array([], dtype=np.int64)
+            rows = np.unique(np.concatenate([self._postings[t] for t in tokens]))
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if result.size == 0:
+                break
+        return result if result is not None else np.arange(self._rows, dtype=np.int64)
+
+
+def search_properties(df, df_full, query):
+    """البحث في قائمة العقارات عن طريق الفهرس النصي"""
+    # Only spaces or punctuation ("-", " ") leave no words to search for
+    if not query or not normalize_search_text(query).split():
+        return df
+    if uses_local_engine(df_full):
+        index = get_frame_registry().get(df_full, "text_index", PropertyTextIndex)
+        labels = df_full.index[index.search(query)]
+        return df[df.index.isin(labels)]
+
+    # Data served by the API: fall back to scanning the current page of results
+    search_mask = df["location"].str.contains(query, case=False, na=False, regex=False)
+    if "title" in df.columns:
+        search_mask |= df["title"].str.contains(query, case=False, na=False, regex=False)
+    return df[search_mask]
+
+
+# ========== Aggregate Cube ==========
+class AggregateCube:
+    """إحصائيات مجمعة مسبقًا لكل state × location × type × payment × bedrooms × bathrooms"""
+
+    DIMENSIONS = ["state", "location", "property_type", "payment_method", "bedrooms", "bathrooms"]
+    MEASURES = ["price", "price_per_m", "area"]
+    MAX_ROLLUPS = 256
+
+    def __init__(self, df):
+        self._rollups = OrderedDict()
+        self._lock = threading.Lock()
+        self.dimensions = [d for d in self.DIMENSIONS if d in df.columns]
+        self.measures = [m for m in self.MEASURES if m in df.columns]
+
+        work = df[self.dimensions + self.measures]
+        squares = {f"{m}_sq": work[m] ** 2 for m in self.measures}
+        work = work.assign(**squares)
+
+        grouped = work.groupby(self.dimensions, dropna=False, observed=True, sort=False)
+        cells = {"rows": grouped.size()}
+        for m in self.measures:
+            cells[f"{m}_count"] = grouped[m].count()
+            cells[f"{m}_sum"] = grouped[m].sum()
+            cells[f"{m}_sumsq"] = grouped[f"{m}_sq"].sum()
+            cells[f"{m}_min"] = grouped[m].min()
+            cells[f"{m}_max"] = grouped[m].max()
+        self.cells = pd.DataFrame(cells).reset_index()
+
+    def covers(self, filters):
+        return all(key in self.dimensions for key in filters)
+
+    def _cells(self, filters):
+        cells = self.cells
+        for key, value in (filters or {}).items():
+            cells = cells[cells[key] == value]
+        return cells
+
+    def _memoized(self, key, compute):
+        # The cube never changes, so roll-ups are kept across reruns (bounded LRU)
+        with self._lock:
+            if key in self._rollups:
+                self._rollups.move_to_end(key)
+                return self._rollups[key]
+        result = compute()
+        with self._lock:
+            self._rollups[key] = result
+            while len(self._rollups) > self.MAX_ROLLUPS:
+                self._rollups.popitem(last=False)
+        return result
+
+    def counts(self, by, filters=None):
+        key = ("counts", by, freeze_params(filters))
+        return self._memoized(
+            key,
+            lambda: self._cells(filters).groupby(by)["rows"].sum().sort_values(ascending=False),
+        )
+
+    def stats(self, by, measure, filters=None):
+        key = ("stats", tuple(by) if isinstance(by, list) else by, measure,
+               freeze_params(filters))
+        return self._memoized(key, lambda: self._rollup(by, measure, filters))
+
+    def _rollup(self, by, measure, filters):
+        grouped = self._cells(filters).groupby(by)
+        sums = grouped[[f"{measure}_count", f"{measure}_sum", f"{measure}_sumsq"]].sum()
+        count = sums[f"{measure}_count"]
+        total = sums[f"{measure}_sum"]
+        sumsq = sums[f"{measure}_sumsq"]
+
+        mean = total / count.where(count > 0)
+        # Sample variance from the running sums, same ddof as pandas .std()
+        variance = ((sumsq - total * mean) / (count - 1).where(count > 1)).clip(lower=0)
+        return pd.DataFrame(
+            {
+                "count": count,
+                "sum": total,
+                "mean": mean,
+                "std": np.sqrt(variance),
+                "min": grouped[f"{measure}_min"].min(),
+                "max": grouped[f"{measure}_max"].max(),
+            }
+        )
+
+
+class MarketView:
+    """تجميعات البيانات المفلترة: من الـ cube لو الفلاتر تسمح، وإلا من الصفوف"""
+
+    def __init__(self, df, cube=None, filters=None):
+        self.df = df
+        self.filters = filters or {}
+        self.cube = cube if cube is not None and cube.covers(self.filters) else None
+
+    def counts(self, col, normalize=False):
+        if self.cube is not None:
+            counts = self.cube.counts(col, self.filters)
+        else:
+            counts = self.df[col].value_counts()
+        if normalize:
+            return counts / counts.sum()
+        return counts
+
+    def stats(self, by, measure):
+        if self.cube is not None:
+            return self.cube.stats(by, measure, self.filters)
+        return self.df.groupby(by)[measure].agg(["count", "sum", "mean", "std", "min", "max"])
+
+    def mean(self, by, measure):
+        return self.stats(by, measure)["mean"]
+
+
+def market_view(df, df_full, filters):
+    """MarketView للبيانات المفلترة مع الـ cube الخاص بنسخة df_full"""
+    if uses_local_engine(df_full):
+        cube = get_frame_registry().get(df_full, "aggregate_cube", AggregateCube)
+        return MarketView(df, cube, filters)
+    return MarketView(df)
+
+
+# ========== Chart Data Layer ==========
+# Above these sizes charts ship pre-aggregated data instead of every row
+CHART_WEBGL_THRESHOLD = 2_000
+CHART_AGGREGATE_THRESHOLD = 5_000
+CHART_DENSITY_THRESHOLD = 20_000
+CHART_SAMPLE_POINTS = 300
+CHART_KDE_GRID = 128
+
+
+def summarize_distribution(values):
+    """ملخص الـ box plot (quartiles و fences) بدل إرسال كل القيم"""
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    return {
+        "q1": q1,
+        "median": median,
+        "q3": q3,
+        "lowerfence": inside.min(),
+        "upperfence": inside.max(),
+        "mean": values.mean(),
+    }
+
+
+def binned_kde(values, grid_size=CHART_KDE_GRID):
+    """KDE تقريبي: histogram + Gaussian smoothing، تكلفته O(n)"""
+    lo, hi = values.min(), values.max()
+    if hi <= lo or len(values) < 2:
+        return np.array([lo]), np.array([1.0])
+
+    counts, edges = np.histogram(values, bins=grid_size, range=(lo, hi))
+    dx = edges[1] - edges[0]
+    bandwidth = 1.06 * values.std() * len(values) ** (-1 / 5)  # Scott's rule
+    sigma = max(bandwidth / dx, 0.5)
+    radius = min(int(np.ceil(3 * sigma)), grid_size - 1)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+
+    density = np.convolve(counts, kernel, mode="same")
+    density = density / (density.sum() * dx)
+    return (edges[:-1] + edges[1:]) / 2, density
+
+
+def distribution_figure(df, x, y, kind="violin", color=None, points=None, title=None, labels=None):
+    """Violin / Box: بالصفوف للبيانات الصغيرة، وبملخص محسوب على السيرفر للكبيرة"""
+    if len(df) <= CHART_AGGREGATE_THRESHOLD:
+        if kind == "violin":
+            return px.violin(df, x=x, y=y, box=True, points=points, color=color,
+                             title=title, labels=labels)
+        return px.box(df, x=x, y=y, color=color, title=title, labels=labels)
+
+    labels = labels or {}
+    split_by_color = color is not None and color != x
+    data = df[[y, x, color] if split_by_color else [y, x]].dropna()
+    categories = sorted(data[x].unique().tolist())
+    color_groups = sorted(data[color].unique().tolist()) if split_by_color else [None]
+    palette = px.colors.qualitative.Plotly
+    slot = 0.8 / len(color_groups)
+    rng = np.random.default_rng(0)
+
+    fig = go.Figure()
+    for j, group_name in enumerate(color_groups):
+        trace_color = palette[j % len(palette)]
+        legend_name = str(group_name) if group_name is not None else y
+        group_data = data if group_name is None else data[data[color] == group_name]
+        box_stats = {"x": [], "q1": [], "median": [], "q3": [],
+                     "lowerfence": [], "upperfence": [], "mean": []}
+
+        for i, category in enumerate(categories):
+            values = group_data.loc[group_data[x] == category, y].to_numpy(dtype=float)
+            values = values[np.isfinite(values)]
+            if len(values) == 0:
+                continue
+            position = i + (j - (len(color_groups) - 1) / 2) * slot
+            shape_color = palette[i % len(palette)] if color == x else trace_color
+
+            if kind == "violin":
+                grid, density = binned_kde(values)
+                half_width = 0.45 * slot * density / density.max()
+                fig.add_trace(go.Scatter(
+                    x=np.concatenate([position - half_width, (position + half_width)[::-1]]),
+                    y=np.concatenate([grid, grid[::-1]]),
+                    fill="toself", mode="lines", line={"color": shape_color, "width": 1},
+                    name=legend_name, legendgroup=legend_name, showlegend=False,
+                    hoverinfo="skip",
+                ))
+                if points == "all":
+                    sample = values if len(values) <= CHART_SAMPLE_POINTS else rng.choice(
+                        values, CHART_SAMPLE_POINTS, replace=False)
+                    fig.add_trace(go.Scattergl(
+                        x=position + rng.uniform(-0.3, 0.3, len(sample)) * slot, y=sample,
+                        mode="markers", marker={"color": shape_color, "size": 3, "opacity": 0.5},
+                        name=legend_name, legendgroup=legend_name, showlegend=False,
+                    ))
+
+            box_stats["x"].append(position if kind == "violin" else category)
+            for stat, value in summarize_distribution(values).items():
+                box_stats[stat].append(value)
+
+        fig.add_trace(go.Box(
+            **box_stats,
+            name=legend_name, legendgroup=legend_name, offsetgroup=legend_name,
+            marker_color=trace_color, boxpoints=False,
+            width=slot * 0.15 if kind == "violin" else None,
+            showlegend=split_by_color,
+        ))
+
+    fig.update_layout(
+        title=title,
+        xaxis_title=labels.get(x, x),
+        yaxis_title=labels.get(y, y),
+        legend_title=labels.get(color, color) if split_by_color else None,
+        boxmode="group" if kind == "box" else "overlay",
+    )
+    if kind == "violin":
+        fig.update_xaxes(tickvals=list(range(len(categories))), ticktext=[str(c) for c in categories])
+    return fig
+
+
+def price_area_figure(df, color=None, size=None, hover_data=None, title=None, labels=None):
+    """Scatter للبيانات الصغيرة، WebGL للمتوسطة، و 2D histogram للكبيرة"""
+    if len(df) <= CHART_DENSITY_THRESHOLD:
+        render_mode = "webgl" if len(df) > CHART_WEBGL_THRESHOLD else "auto"
+        return px.scatter(df, x="area", y="price", color=color, size=size, hover_data=hover_data,
+                          title=title, labels=labels, render_mode=render_mode)
+
+    data = df[["area", "price"]].dropna()
+    # Clip the long tail so the bins cover where the listings actually are
+    area_hi = np.percentile(data["area"], 99.5)
+    price_hi = np.percentile(data["price"], 99.5)
+    counts, area_edges, price_edges = np.histogram2d(
+        data["area"], data["price"], bins=80,
+        range=[[data["area"].min(), area_hi], [data["price"].min(), price_hi]],
+    )
+    z = np.where(counts.T > 0, counts.T, np.nan)
+    fig = go.Figure(go.Heatmap(
+        x=(area_edges[:-1] + area_edges[1:]) / 2,
+        y=(price_edges[:-1] + price_edges[1:]) / 2,
+        z=z, colorscale="Viridis", colorbar={"title": "Properties"},
+        hovertemplate="Area: %{x:,.0f} m²<br>Price: %{y:,.0f} EGP<br>Properties: %{z}<extra></extra>",
+    ))
+    labels = labels or {}
+    fig.update_layout(title=title, xaxis_title=labels.get("area", "area"),
+                      yaxis_title=labels.get("price", "price"))
+    return fig
+
+
+def histogram_figure(df, x, nbins=30, title=None, labels=None, **kwargs):
+    """Histogram محسوب على السيرفر للبيانات الكبيرة"""
+    if len(df) <= CHART_AGGREGATE_THRESHOLD:
+        return px.histogram(df, x=x, nbins=nbins, title=title, labels=labels, **kwargs)
+
+    values = pd.to_numeric(df[x], errors="coerce").dropna().to_numpy()
+    counts, edges = np.histogram(values, bins=nbins or 30)
+    fig = px.bar(
+        x=(edges[:-1] + edges[1:]) / 2, y=counts, title=title,
+        labels={"x": (labels or {}).get(x, x), "y": "count"},
+        color_discrete_sequence=kwargs.get("color_discrete_sequence"),
+        text_auto=kwargs.get("text_auto", False),
+    )
+    fig.update_layout(bargap=0)
+    return fig
+
+
+# ========== Figure Cache ==========
+class FigureCache:
+    """كاش للرسومات كـ JSON حسب (نسخة البيانات، الفلاتر، الرسمة)"""
+
+    def __init__(self, max_bytes=64 * 1024 ** 2, metrics=None):
+        self.max_bytes = max_bytes
+        self._specs = OrderedDict()  # key -> figure JSON
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.metrics = metrics or CacheMetrics("figure", "unnamed")
+        self.metrics.gauges = lambda: {"entries": len(self._specs), "bytes": self._total_bytes}
+
+    def get(self, key, build):
+        start = time.perf_counter()
+        with self._lock:
+            spec = self._specs.get(key)
+            if spec is not None:
+                self._specs.move_to_end(key)
+        lookup = time.perf_counter() - start
+        if spec is not None:
+            self.metrics.add(hits=1, lookup_seconds=lookup)
+        else:
+            self.metrics.add(misses=1, lookup_seconds=lookup)
+
+        if spec is None:
+            start = time.perf_counter()
+            spec = build().to_json()
+            self.metrics.add(load_seconds=time.perf_counter() - start)
+            with self._lock:
+                if key not in self._specs:
+                    self._specs[key] = spec
+                    self._total_bytes += len(spec)
+                while self._total_bytes > self.max_bytes and len(self._specs) > 1:
+                    _, evicted = self._specs.popitem(last=False)
+                    self._total_bytes -= len(evicted)
+                    self.metrics.add(evictions=1)
+
+        # The spec was validated when it was first built, skip plotly's validation
+        return go.Figure(json.loads(spec), _validate=False)
+
+
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache(metrics=get_cache_metrics().register("figure", "charts"))
+
+
+def cached_figure(view_key, chart_id, build):
+    """الرسمة من الكاش، أو build() لو مش موجودة"""
+    with profiled(f"chart:{chart_id}"):
+        return get_figure_cache().get((view_key, chart_id), build)
+
+
+class ViewFrameCache:
+    """LRU للجداول المحسوبة لكل view (زي بيانات الـ treemap)، المفتاح tokens النسخ + الفلاتر"""
+
+    def __init__(self, max_entries=64, max_bytes=128 * 1024 ** 2, metrics=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()  # key -> (frame, size)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.metrics = metrics or CacheMetrics("view", "unnamed")
+        self.metrics.gauges = lambda: {"entries": len(self._frames), "bytes": self._total_bytes}
+
+    def get(self, key, build):
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None:
+                self._frames.move_to_end(key)
+                self.metrics.add(hits=1, lookup_seconds=time.perf_counter() - start)
+                return entry[0]
+        self.metrics.add(misses=1, lookup_seconds=time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            frame = build()
+        finally:
+            self.metrics.add(load_seconds=time.perf_counter() - start)
+        size = _estimate_size(frame)
+        with self._lock:
+            if key not in self._frames:
+                self._frames[key] = (frame, size)
+                self._total_bytes += size
+            while len(self._frames) > 1 and (
+                len(self._frames) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                _, (_, evicted_size) = self._frames.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.metrics.add(evictions=1)
+        # Shared by every session that asks for the same view, so callers only read it
+        return frame
+
+
+@st.cache_resource
+def get_view_frame_cache(name, max_entries=64):
+    return ViewFrameCache(max_entries=max_entries, metrics=get_cache_metrics().register("view", name))
+
+
 # ========== Helper Functions ==========
 def calculate_price_per_m(price, area):
     return price / area if area > 0 else 0
@@ -213,171 +1606,72 @@ def normalize_series(series):
 
 
 # ========== Buy Score & Treemap Functions (adapted from desktop file) ==========
-def enrich_with_area_features(df, area_df):
-    """ربط بيانات العقارات بخصائص المنطقة"""
-    df = df.copy()
-    if area_df.empty:
-        return df
-
-    # Map area intelligence columns - try matching on state or location
-    area_numeric_cols = [
-        "near_sea", "schools_quality", "services_level",
-        "transportation", "investment_potential", "resale_liquidity", "area_score"
-    ]
-
-    # Check if area_df has the expected columns
-    area_cols_present = [c for c in area_numeric_cols if c in area_df.columns]
-    if not area_cols_present:
-        return df
+@st.cache_resource
+def get_price_model(backend_name=None):
+    price_model = IncrementalPriceModel(get_backend(backend_name))
+    sizes = {}  # model version -> estimated bytes, each published model is measured once
 
-    # Try to merge on state or location
-    merge_col = None
-    if "area_name" in area_df.columns:
-        merge_col = "area_name"
-    elif "state" in area_df.columns:
-        merge_col = "state"
-    elif "location" in area_df.columns:
-        merge_col = "location"
-
-    if merge_col and merge_col in df.columns:
-        df = df.merge(area_df, left_on=merge_col, right_on=merge_col, how="left", suffixes=("", "_area"))
-
-    # Fill missing area intelligence values with defaults
-    for col in area_numeric_cols:
-        if col in df.columns:
-            df[col] = df[col].fillna(df[col].median() if not df[col].isna().all() else 3)
-        else:
-            if col == "area_score":
-                df[col] = 70
-            elif col == "near_sea":
-                df[col] = 0
-            else:
-                df[col] = 3
+    def gauges():
+        fitted = price_model.snapshot()
+        if fitted is None:
+            return {"entries": 0, "bytes": 0}
+        if fitted.version not in sizes:
+            sizes.clear()
+            sizes[fitted.version] = _estimate_size(fitted)
+        return {"entries": 1, "bytes": sizes[fitted.version]}
 
-    return df
+    get_cache_metrics().register("model", price_model.backend.name).gauges = gauges
+    return price_model
 
 
-@st.cache_resource(ttl=3600)
+@profiled_function("train_model_once")
 def train_model_once(df):
-    """تدريب النموذج مرة واحدة مع دمج ذكاء المناطق"""
+    """تدريب النموذج مرة واحدة لكل نسخة بيانات، والنسخ الجديدة بتحدّثه تدريجيًا"""
     if df.empty or len(df) < 50:
         return None, [], {}
 
-    ml_df = df.copy()
-
-    # Load & Merge Area Intelligence
-    area_df = load_area_intelligence()
-    ml_df = enrich_with_area_features(ml_df, area_df)
-
-    # Payment Method Encoding
-    if "payment_method" in ml_df.columns:
-        ml_df["payment_code"] = (
-            ml_df["payment_method"]
-            .map({"Cash": 0, "Installments": 1, "نقدي": 0, "تقسيط": 1})
-            .fillna(0)
-        )
-
-    # Property Type Encoding
-    property_map = {}
-    if "property_type" in ml_df.columns:
-        property_types = ml_df["property_type"].dropna().unique()
-        property_map = {pt: i for i, pt in enumerate(property_types)}
-        ml_df["property_type_code"] = ml_df["property_type"].map(property_map)
-
-    # Feature Selection
-    numeric_features = []
-    candidates = [
-        "area", "bedrooms", "bathrooms", "price_per_m",
-        "payment_code", "property_type_code",
-        "near_sea", "schools_quality", "services_level",
-        "transportation", "investment_potential", "resale_liquidity", "area_score",
-    ]
-
-    for col in candidates:
-        if col in ml_df.columns:
-            numeric_features.append(col)
-
-    ml_df = ml_df[numeric_features + ["price"]].dropna()
-
-    if len(ml_df) < 50:
-        return None, [], {}
-
-    X = ml_df[numeric_features]
-    y = ml_df["price"]
-
+    price_model = get_price_model()
     try:
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=45
+        get_frame_registry().get(
+            df, "price_model_update", lambda d: price_model.update(d, load_area_features())
         )
-
-        rf_model = RandomForestRegressor(
-            n_estimators=150, max_depth=20, random_state=47, n_jobs=-1
-        )
-        rf_model.fit(X_train, y_train)
-
-        y_pred = rf_model.predict(X_test)
-        mae = mean_absolute_error(y_test, y_pred)
-
-        st.session_state["model_mae"] = round(mae, 2)
-
-        return rf_model, numeric_features, property_map
-
     except Exception as e:
         st.sidebar.error(f"❌ Model training error: {str(e)[:100]}")
+
+    model = price_model.snapshot()
+    if model is None:
         return None, [], {}
+    st.session_state["model_mae"] = round(model.mae, 2)
+    return model, model.features, model.property_map
 
 
-def create_treemap_data(filtered_df, model, features, prop_map):
+@profiled_function("create_treemap_data")
+def create_treemap_data(filtered_df, model, features, prop_map, market=None):
     """إنشاء بيانات Treemap مع Buy Score"""
     if filtered_df.empty:
         return pd.DataFrame()
-
-    # Merge area intelligence
-    area_df = load_area_intelligence()
-    filtered_df = enrich_with_area_features(filtered_df, area_df)
+    if market is None:
+        market = MarketView(filtered_df)
 
     # Aggregations by State and Location
-    stats_df = (
-        filtered_df.groupby(["state", "location"])
-        .agg({"price_per_m": ["mean", "count", "std"], "price": "mean", "area": "mean"})
-        .reset_index()
-    )
-    stats_df.columns = [
-        "_".join(col).strip("_") if col[1] else col[0]
-        for col in stats_df.columns.values
-    ]
-
-    # Rename columns for clarity
-    stats_df = stats_df.rename(
-        columns={
-            "price_per_m_mean": "Price_Per_M_mean",
-            "price_mean": "Avg_Price",
-            "area_mean": "Avg_Area",
-            "price_per_m_count": "Property_Count",
-            "price_per_m_std": "Price_Std",
+    by = ["state", "location"]
+    price_per_m_stats = market.stats(by, "price_per_m")
+    stats_df = pd.DataFrame(
+        {
+            "Price_Per_M_mean": price_per_m_stats["mean"],
+            "Property_Count": price_per_m_stats["count"],
+            "Price_Std": price_per_m_stats["std"],
+            "Avg_Price": market.mean(by, "price"),
+            "Avg_Area": market.mean(by, "area"),
         }
-    )
+    ).reset_index()
+    stats_df = stats_df[stats_df["Property_Count"] > 0].reset_index(drop=True)
 
     # Fill NaN Std with 0
     stats_df["Price_Std"] = stats_df["Price_Std"].fillna(0)
 
-    # Calculate area intelligence scores per location
-    area_stats = (
-        filtered_df.groupby(["state", "location"])
-        .agg({
-            "area_score": "mean",
-            "investment_potential": "mean",
-            "resale_liquidity": "mean",
-            "schools_quality": "mean",
-            "services_level": "mean",
-            "transportation": "mean",
-            "near_sea": "mean",
-        })
-        .reset_index()
-    )
-
-    # Merge area stats
-    stats_df = stats_df.merge(area_stats, on=["state", "location"], how="left")
+    # Area intelligence is keyed by state/location, so merge it per group
+    stats_df = enrich_with_area_features(stats_df, load_area_features())
 
     # Calculate Area Intelligence Score
     def calculate_area_intelligence(row):
@@ -405,36 +1699,31 @@ def create_treemap_data(filtered_df, model, features, prop_map):
 
     stats_df["Area_Intelligence_Score"] = stats_df.apply(calculate_area_intelligence, axis=1)
 
-    # Prediction Logic using Cached Model
+    # Prediction Logic using Cached Model, all groups in one batch
     if model is not None and features:
         try:
-            fair_prices = []
-            for idx, row in stats_df.iterrows():
-                input_data = {
-                    "area": row["Avg_Area"],
-                    "bedrooms": 3,
-                    "bathrooms": 2,
-                    "price_per_m": row["Price_Per_M_mean"],
-                    "payment_code": 0,
-                    "property_type_code": prop_map.get("Apartment", 0),
-                    "near_sea": row.get("near_sea", 0),
-                    "schools_quality": row.get("schools_quality", 3),
-                    "services_level": row.get("services_level", 3),
-                    "transportation": row.get("transportation", 3),
-                    "investment_potential": row.get("investment_potential", 3),
-                    "resale_liquidity": row.get("resale_liquidity", 3),
-                    "area_score": row.get("area_score", 70),
-                }
-
-                pred_vector = [input_data.get(f, 0) for f in features]
-                predicted_price = model.predict([pred_vector])[0]
-                fair_prices.append(predicted_price)
-
-            stats_df["Fair_Price"] = fair_prices
+            # A typical apartment (3 bed / 2 bath, cash) of the group's average size
+            area_cols = [c for c in AREA_FEATURES if c in stats_df.columns]
+            group_rows = stats_df[["location", "state"] + area_cols].assign(
+                property_type="Apartment",
+                property_type_code=prop_map.get("Apartment", 0),
+                area=stats_df["Avg_Area"],
+                bedrooms=3,
+                bathrooms=2,
+                payment_code=0,
+            )
+            fair_price, fair_low, fair_high = model.predict_interval(group_rows)
+            stats_df["Fair_Price"] = fair_price
+            stats_df["Fair_Price_Low"] = fair_low
+            stats_df["Fair_Price_High"] = fair_high
         except Exception as e:
             stats_df["Fair_Price"] = stats_df["Price_Per_M_mean"] * stats_df["Avg_Area"]
     else:
         stats_df["Fair_Price"] = stats_df["Price_Per_M_mean"] * stats_df["Avg_Area"]
+    # Without a model there is no spread, so the range collapses to the point estimate
+    for bound in ("Fair_Price_Low", "Fair_Price_High"):
+        if bound not in stats_df.columns:
+            stats_df[bound] = stats_df["Fair_Price"]
 
     # Scoring Logic
     price_min = stats_df["Price_Per_M_mean"].min()
@@ -516,6 +1805,20 @@ def create_treemap_data(filtered_df, model, features, prop_map):
     return stats_df
 
 
+def treemap_for_view(df, df_full, market, view_key):
+    """جدول الـ Treemap ومفتاحه (نسخة البيانات، الفلاتر، النموذج، المناطق)، والمفتاح بيتستخدم لكاش الرسمة كمان"""
+    rf_model, model_features, prop_map = train_model_once(df_full)
+    key = (
+        view_key,
+        rf_model.version if rf_model is not None else None,
+        get_frame_registry().version(load_area_intelligence()),
+    )
+    treemap_data = get_view_frame_cache("treemap").get(
+        key, lambda: create_treemap_data(df, rf_model, model_features, prop_map, market)
+    )
+    return treemap_data, key
+
+
 def create_buy_score_gauge(score):
     """إنشاء مقياس Buy Score"""
     fig = go.Figure(
@@ -553,12 +1856,12 @@ def create_buy_score_gauge(score):
     return fig
 
 
-def get_purchase_recommendations(filtered_df):
+def get_purchase_recommendations(filtered_df, market=None):
     """توليد توصيات الشراء"""
     recommendations = []
     try:
         if not filtered_df.empty and "bedrooms" in filtered_df.columns:
-            room_counts = filtered_df["bedrooms"].value_counts()
+            room_counts = (market or MarketView(filtered_df)).counts("bedrooms")
             if not room_counts.empty:
                 most_popular = room_counts.idxmax()
                 recommendations.append(f"- الشقق {most_popular} غرف هي الأكثر طلبًا حاليًا")
@@ -599,11 +1902,13 @@ def calculate_area_insights(filtered_df):
     return best_area_text, price_rate_text
 
 
-def calculate_market_insights(df):
+def calculate_market_insights(df, market=None):
     """حساب رؤى السوق"""
     insights = {}
     if len(df) == 0:
         return insights
+    if market is None:
+        market = MarketView(df)
     if "price" in df.columns:
         insights["price_stats"] = {
             "mean": df["price"].mean(),
@@ -617,37 +1922,110 @@ def calculate_market_insights(df):
             "median": df["price_per_m"].median(),
         }
     if "location" in df.columns and "price_per_m" in df.columns:
-        location_prices = df.groupby("location")["price_per_m"].mean().sort_values(ascending=False)
+        location_prices = market.mean("location", "price_per_m").sort_values(ascending=False)
         insights["expensive_areas"] = location_prices.head(5).to_dict()
         insights["affordable_areas"] = location_prices.tail(5).to_dict()
     if "property_type" in df.columns:
-        property_dist = df["property_type"].value_counts(normalize=True) * 100
+        property_dist = market.counts("property_type", normalize=True) * 100
         insights["property_distribution"] = property_dist.to_dict()
     if "payment_method" in df.columns:
-        payment_dist = df["payment_method"].value_counts(normalize=True) * 100
+        payment_dist = market.counts("payment_method", normalize=True) * 100
         insights["payment_distribution"] = payment_dist.to_dict()
     return insights
 
 
-def export_to_csv(df):
-    """تصدير البيانات إلى CSV"""
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_str = csv_buffer.getvalue()
-    b64 = base64.b64encode(csv_str.encode()).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="real_estate_data.csv">📥 Download CSV File</a>'
-    return href
+# Rows serialized per step, so an export never needs a second full copy of the data
+EXPORT_CHUNK_ROWS = 20_000
+EXPORT_FILE_NAME = "real_estate_data"
+EXPORT_FORMATS = {
+    "csv": ("📥 CSV", "text/csv"),
+    "csv.gz": ("🗜️ CSV (gzip)", "application/gzip"),
+    "xlsx": ("📊 Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("🧱 Parquet", "application/vnd.apache.parquet"),
+}
+
+
+def iter_export_chunks(df):
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        yield df.iloc[start:start + EXPORT_CHUNK_ROWS]
+
+
+def export_to_csv(df, compress=False):
+    """تصدير البيانات إلى CSV (أو CSV مضغوط gzip) على دفعات"""
+    buffer = io.BytesIO()
+    stream = gzip.GzipFile(fileobj=buffer, mode="wb") if compress else buffer
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    for i, chunk in enumerate(iter_export_chunks(df)):
+        chunk.to_csv(text, index=False, header=(i == 0))
+    if len(df) == 0:
+        df.to_csv(text, index=False)
+    text.flush()
+    text.detach()
+    if compress:
+        stream.close()
+    buffer.seek(0)
+    return buffer
 
 
 def export_to_excel(df):
-    """تصدير البيانات إلى Excel"""
-    excel_buffer = io.BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Real Estate')
-    excel_buffer.seek(0)
-    b64 = base64.b64encode(excel_buffer.read()).decode()
-    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="real_estate_data.xlsx">📥 Download Excel File</a>'
-    return href
+    """تصدير البيانات إلى Excel على دفعات (openpyxl write-only)"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Real Estate")
+    sheet.append([str(c) for c in df.columns])
+    for chunk in iter_export_chunks(df):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def export_to_parquet(df):
+    """تصدير البيانات إلى Parquet، كل دفعة row group لوحدها"""
+    buffer = io.BytesIO()
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(buffer, schema, compression="snappy") as writer:
+        for chunk in iter_export_chunks(df):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    buffer.seek(0)
+    return buffer
+
+
+def export_file(df, fmt):
+    """الملف كـ BytesIO متلفلف للأول، download_button بيقراه من غير نسخة bytes زيادة"""
+    if fmt == "csv":
+        return export_to_csv(df)
+    if fmt == "csv.gz":
+        return export_to_csv(df, compress=True)
+    if fmt == "xlsx":
+        return export_to_excel(df)
+    if fmt == "parquet":
+        return export_to_parquet(df)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def render_export_buttons(df, key_prefix="export"):
+    """أزرار التحميل: الملف بيتعمل بس لما المستخدم يدوس"""
+    formats = [f for f in EXPORT_FORMATS if f != "parquet" or pa is not None]
+    # The click comes after the rerun ended, so the export only lands in the rolling timings
+    run = current_profile()
+    for col, fmt in zip(st.columns(len(formats)), formats):
+        label, mime = EXPORT_FORMATS[fmt]
+        with col:
+            st.download_button(
+                label,
+                # Called only on click, in its own thread
+                data=lambda fmt=fmt: run.call(f"export:{fmt}", export_file, df, fmt) if run else export_file(df, fmt),
+                file_name=f"{EXPORT_FILE_NAME}.{fmt}",
+                mime=mime,
+                key=f"{key_prefix}_{fmt}",
+                on_click="ignore",
+                width="stretch",
+            )
 
 
 # ========== Dashboard Header ==========
@@ -657,7 +2035,7 @@ st.markdown(
 st.markdown('<div class="custom-divider"></div>', unsafe_allow_html=True)
 
 # Sidebar
-with st.sidebar:
+with st.sidebar, profiled("sidebar"):
     st.image("https://img.icons8.com/color/96/real-estate.png", width=80)
     st.markdown("## 🔍 Filters")
 
@@ -740,34 +2118,114 @@ with st.sidebar:
     st.markdown("---")
     st.caption(f"🔄 Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
 
-# Main content - 4 tabs now
-tab1, tab2, tab3, tab4 = st.tabs(["📊 Dashboard", "📈 Market Insights", "🤖 AI Predictions", "⏰ Time Analysis"])
+# ========== Filtered Data ==========
+# Build filters
+filters = {}
+if selected_city != "All":
+    filters["state"] = selected_city
+if selected_type != "All":
+    filters["property_type"] = selected_type
+if selected_bedrooms != "All":
+    filters["bedrooms"] = selected_bedrooms
+if selected_bathrooms != "All":
+    filters["bathrooms"] = selected_bathrooms
+# Untouched sliders are not filters, so aggregates can come from the cube
+if price_range is not None and price_range != (price_min, price_max):
+    filters["min_price"] = price_range[0]
+    filters["max_price"] = price_range[1]
+if area_range is not None and area_range != (area_min, area_max):
+    filters["min_area"] = area_range[0]
+    filters["max_area"] = area_range[1]
+if selected_payment != "All":
+    filters["payment_method"] = selected_payment
+
+# Filter the already loaded data in memory
+with st.spinner("Loading properties..."), profiled("filter"):
+    df = query_properties(df_full, filters)
+    market = market_view(df, df_full, filters)
+# Charts for this data version + filter combination are served from the figure cache
+view_key = (get_frame_registry().version(df_full), freeze_params(filters))
+
+
+# Main content - 4 tabs now, only the selected one is computed
+tab1, tab2, tab3, tab4 = st.tabs(
+    ["📊 Dashboard", "📈 Market Insights", "🤖 AI Predictions", "⏰ Time Analysis"],
+    key="active_view",
+    on_change="rerun",
+)
+
+# ========== Property List ==========
+def change_page(step, total_pages):
+    st.session_state.page_number = min(total_pages, max(1, st.session_state.page_number + step))
 
-# ========== Tab 1: Dashboard ==========
-with tab1:
-    # Build filters
-    filters = {}
-    if selected_city != "All":
-        filters["state"] = selected_city
-    if selected_type != "All":
-        filters["property_type"] = selected_type
-    if selected_bedrooms != "All":
-        filters["bedrooms"] = selected_bedrooms
-    if selected_bathrooms != "All":
-        filters["bathrooms"] = selected_bathrooms
-    if price_range is not None:
-        filters["min_price"] = price_range[0]
-        filters["max_price"] = price_range[1]
-    if area_range is not None:
-        filters["min_area"] = area_range[0]
-        filters["max_area"] = area_range[1]
-    if selected_payment != "All":
-        filters["payment_method"] = selected_payment
-
-    # Load filtered data
-    with st.spinner("Loading properties..."):
-        df = load_data_from_api(filters)
 
+@st.fragment
+def render_property_list(df, df_full):
+    """قائمة العقارات: البحث والتنقل بين الصفحات بيعيدوا تشغيل الجزء ده بس"""
+    st.markdown("## 📋 Property List")
+
+    search = st.text_input(
+        "🔍 Search properties...", placeholder="Type location or property name..."
+    )
+
+    display_df = search_properties(df, df_full, search)
+
+    # Select columns to display
+    cols_to_show = [
+        "title", "property_type", "price", "location", "state",
+        "bedrooms", "area", "payment_method", "price_per_m",
+    ]
+    available_cols = [c for c in cols_to_show if c in display_df.columns]
+
+    # Pagination
+    items_per_page = 20
+    total_items = len(display_df)
+    total_pages = max(1, (total_items + items_per_page - 1) // items_per_page)
+
+    if "page_number" not in st.session_state:
+        st.session_state.page_number = 1
+
+    # The page moves in on_click, before the fragment reruns, so the label and buttons
+    # below already show it without rerunning the whole app
+    col1, col2, col3 = st.columns([1, 3, 1])
+    with col1:
+        st.button(
+            "◀️ Previous", disabled=(st.session_state.page_number <= 1),
+            on_click=change_page, args=(-1, total_pages),
+        )
+    with col2:
+        st.markdown(
+            f"<div style='text-align: center; padding: 8px;'>Page {st.session_state.page_number} of {total_pages} ({total_items:,} properties)</div>",
+            unsafe_allow_html=True,
+        )
+    with col3:
+        st.button(
+            "Next ▶️", disabled=(st.session_state.page_number >= total_pages),
+            on_click=change_page, args=(1, total_pages),
+        )
+
+    start_idx = (st.session_state.page_number - 1) * items_per_page
+    end_idx = min(start_idx + items_per_page, total_items)
+
+    st.dataframe(
+        display_df[available_cols].iloc[start_idx:end_idx],
+        width='stretch',
+        hide_index=True,
+        column_config={
+            "price": st.column_config.NumberColumn("Price", format="%d EGP"),
+            "area": st.column_config.NumberColumn("Area", format="%.0f m²"),
+            "price_per_m": st.column_config.NumberColumn("Price/m²", format="%d EGP"),
+        },
+    )
+
+    # Data Export (medium priority)
+    st.markdown("### 📥 Export Data")
+    render_export_buttons(display_df)
+
+
+# ========== Tab 1: Dashboard ==========
+def render_dashboard(df, df_full, market, view_key):
+    """Tab 1: المؤشرات والرسومات وقائمة العقارات"""
     if df.empty:
         st.info("No properties found matching your filters. Try adjusting them.")
     else:
@@ -829,9 +2287,8 @@ with tab1:
         st.markdown('<div class="custom-divider"></div>', unsafe_allow_html=True)
 
         # Market Sentiment Indicator (from desktop file)
-        # Train model for treemap data
-        rf_model, model_features, prop_map = train_model_once(df)
-        treemap_data = create_treemap_data(df, rf_model, model_features, prop_map)
+        # One model for the whole dataset, filters only change the groups it scores
+        treemap_data, _ = treemap_for_view(df, df_full, market, view_key)
 
         if not treemap_data.empty:
             avg_buy_score = treemap_data["Buy_Score"].mean()
@@ -851,106 +2308,127 @@ with tab1:
 
         with col1:
             if "state" in df.columns:
-                state_counts = df["state"].value_counts().head(10)
-                fig = px.bar(
-                    x=state_counts.values,
-                    y=state_counts.index,
-                    orientation="h",
-                    title="🏙️ Top 10 States by Properties",
-                    color=state_counts.values,
-                    color_continuous_scale="Viridis",
-                    labels={"x": "Number of Properties", "y": "State"},
-                )
-                fig.update_layout(height=400)
-                st.plotly_chart(fig, width='stretch')
+                def build_states_bar():
+                    state_counts = market.counts("state").head(10)
+                    fig = px.bar(
+                        x=state_counts.values,
+                        y=state_counts.index,
+                        orientation="h",
+                        title="🏙️ Top 10 States by Properties",
+                        color=state_counts.values,
+                        color_continuous_scale="Viridis",
+                        labels={"x": "Number of Properties", "y": "State"},
+                    )
+                    fig.update_layout(height=400)
+                    return fig
+
+                st.plotly_chart(cached_figure(view_key, "states_bar", build_states_bar), width='stretch')
 
         with col2:
             if "property_type" in df.columns:
-                type_counts = df["property_type"].value_counts()
-                fig = px.pie(
-                    values=type_counts.values,
-                    names=type_counts.index,
-                    title="🏘️ Property Type Distribution",
-                    color_discrete_sequence=px.colors.sequential.Viridis,
-                )
-                fig.update_layout(height=400)
-                st.plotly_chart(fig, width='stretch')
+                def build_types_pie():
+                    type_counts = market.counts("property_type")
+                    fig = px.pie(
+                        values=type_counts.values,
+                        names=type_counts.index,
+                        title="🏘️ Property Type Distribution",
+                        color_discrete_sequence=px.colors.sequential.Viridis,
+                    )
+                    fig.update_layout(height=400)
+                    return fig
+
+                st.plotly_chart(cached_figure(view_key, "types_pie", build_types_pie), width='stretch')
 
         # Charts Row 2 - Violin plots (from desktop file)
         col1, col2 = st.columns(2)
 
         with col1:
             if "property_type" in df.columns and "price" in df.columns:
-                fig_violin1 = px.violin(
-                    df,
-                    x="property_type",
-                    y="price",
-                    box=True,
-                    color="payment_method" if "payment_method" in df.columns else None,
-                    title="🎻 Price Distribution by Property Type",
-                    labels={"property_type": "Property Type", "price": "Price (EGP)"},
-                )
-                fig_violin1.update_layout(height=400)
-                st.plotly_chart(fig_violin1, width='stretch')
+                def build_violin_by_type():
+                    fig_violin1 = distribution_figure(
+                        df,
+                        x="property_type",
+                        y="price",
+                        kind="violin",
+                        color="payment_method" if "payment_method" in df.columns else None,
+                        title="🎻 Price Distribution by Property Type",
+                        labels={"property_type": "Property Type", "price": "Price (EGP)"},
+                    )
+                    fig_violin1.update_layout(height=400)
+                    return fig_violin1
+
+                st.plotly_chart(cached_figure(view_key, "violin_by_type", build_violin_by_type), width='stretch')
 
         with col2:
             if "payment_method" in df.columns and "price" in df.columns:
-                fig_violin2 = px.violin(
-                    df,
-                    x="payment_method",
-                    y="price",
-                    box=True,
-                    points="all",
-                    color="payment_method",
-                    title="🎻 Price Distribution by Payment Method",
-                    labels={"payment_method": "Payment Method", "price": "Price (EGP)"},
-                )
-                fig_violin2.update_layout(height=400)
-                st.plotly_chart(fig_violin2, width='stretch')
+                def build_violin_by_payment():
+                    fig_violin2 = distribution_figure(
+                        df,
+                        x="payment_method",
+                        y="price",
+                        kind="violin",
+                        points="all",
+                        color="payment_method",
+                        title="🎻 Price Distribution by Payment Method",
+                        labels={"payment_method": "Payment Method", "price": "Price (EGP)"},
+                    )
+                    fig_violin2.update_layout(height=400)
+                    return fig_violin2
+
+                st.plotly_chart(cached_figure(view_key, "violin_by_payment", build_violin_by_payment), width='stretch')
 
         # Charts Row 3 - Box plots (from desktop file)
         col1, col2 = st.columns(2)
 
         with col1:
             if "bedrooms" in df.columns and "price_per_m" in df.columns:
-                fig_box1 = px.box(
-                    df,
-                    x="bedrooms",
-                    y="price_per_m",
-                    color="property_type" if "property_type" in df.columns else None,
-                    title="📦 Price/m² Distribution by Bedrooms",
-                    labels={"bedrooms": "Bedrooms", "price_per_m": "Price/m² (EGP)"},
-                )
-                fig_box1.update_layout(height=400)
-                st.plotly_chart(fig_box1, width='stretch')
+                def build_box_by_bedrooms():
+                    fig_box1 = distribution_figure(
+                        df,
+                        x="bedrooms",
+                        kind="box",
+                        y="price_per_m",
+                        color="property_type" if "property_type" in df.columns else None,
+                        title="📦 Price/m² Distribution by Bedrooms",
+                        labels={"bedrooms": "Bedrooms", "price_per_m": "Price/m² (EGP)"},
+                    )
+                    fig_box1.update_layout(height=400)
+                    return fig_box1
+
+                st.plotly_chart(cached_figure(view_key, "box_by_bedrooms", build_box_by_bedrooms), width='stretch')
 
         with col2:
             if "bathrooms" in df.columns and "price_per_m" in df.columns:
-                fig_box2 = px.box(
+                def build_box_by_bathrooms():
+                    fig_box2 = distribution_figure(
+                        df,
+                        x="bathrooms",
+                        kind="box",
+                        y="price_per_m",
+                        color="property_type" if "property_type" in df.columns else None,
+                        title="📦 Price/m² Distribution by Bathrooms",
+                        labels={"bathrooms": "Bathrooms", "price_per_m": "Price/m² (EGP)"},
+                    )
+                    fig_box2.update_layout(height=400)
+                    return fig_box2
+
+                st.plotly_chart(cached_figure(view_key, "box_by_bathrooms", build_box_by_bathrooms), width='stretch')
+
+        # Charts Row 4 - Scatter plot
+        if "area" in df.columns and "price" in df.columns:
+            def build_price_vs_area():
+                fig = price_area_figure(
                     df,
-                    x="bathrooms",
-                    y="price_per_m",
                     color="property_type" if "property_type" in df.columns else None,
-                    title="📦 Price/m² Distribution by Bathrooms",
-                    labels={"bathrooms": "Bathrooms", "price_per_m": "Price/m² (EGP)"},
+                    size="bedrooms" if "bedrooms" in df.columns else None,
+                    hover_data=["location", "state"],
+                    title="📈 Price vs Area Analysis",
+                    labels={"area": "Area (m²)", "price": "Price (EGP)"},
                 )
-                fig_box2.update_layout(height=400)
-                st.plotly_chart(fig_box2, width='stretch')
+                fig.update_layout(height=500)
+                return fig
 
-        # Charts Row 4 - Scatter plot
-        if "area" in df.columns and "price" in df.columns:
-            fig = px.scatter(
-                df,
-                x="area",
-                y="price",
-                color="property_type" if "property_type" in df.columns else None,
-                size="bedrooms" if "bedrooms" in df.columns else None,
-                hover_data=["location", "state"],
-                title="📈 Price vs Area Analysis",
-                labels={"area": "Area (m²)", "price": "Price (EGP)"},
-            )
-            fig.update_layout(height=500)
-            st.plotly_chart(fig, width='stretch')
+            st.plotly_chart(cached_figure(view_key, "price_vs_area", build_price_vs_area), width='stretch')
 
         # Area Insights (from desktop file)
         best_area_text, price_rate_text = calculate_area_insights(df)
@@ -958,131 +2436,53 @@ with tab1:
             f"**💡 ملاحظة مهمة:** أفضل قيمة مقابل السعر غالبًا بين **{best_area_text}**. المساحات الأكبر سعرها بيزيد **{price_rate_text}** من قيمتها الفعلية."
         )
 
-        # Price per m² by Location (from desktop file)
+        # Price per m² by Location / State (from desktop file)
+        def build_avg_price_bar(by, ascending, title):
+            def build():
+                avg_price = market.mean(by, "price_per_m").reset_index(name="price_per_m")
+                return px.bar(
+                    avg_price.sort_values("price_per_m", ascending=ascending).head(10),
+                    x=by,
+                    y="price_per_m",
+                    title=title,
+                    color="price_per_m",
+                    color_continuous_scale="Plasma",
+                    labels={by: by.title(), "price_per_m": "Price/m² (EGP)"},
+                )
+            return build
+
         if "location" in df.columns and "price_per_m" in df.columns:
             st.markdown(
                 "📍 **مقارنة المناطق** مش دايمًا المنطقة الأغلى هي الأفضل. في مناطق سعر المتر أقل لكن الطلب عليها أعلى، وده بيدي قيمة أفضل مقابل السعر."
             )
             col1, col2 = st.columns(2)
             with col1:
-                avg_price_by_location = df.groupby("location")["price_per_m"].mean().reset_index()
-                fig_loc_asc = px.bar(
-                    avg_price_by_location.sort_values("price_per_m", ascending=True).head(10),
-                    x="location",
-                    y="price_per_m",
-                    title="📍 Avg Price/m² by Location (ASC)",
-                    color="price_per_m",
-                    color_continuous_scale="Plasma",
-                    labels={"location": "Location", "price_per_m": "Price/m² (EGP)"},
-                )
+                fig_loc_asc = cached_figure(view_key, "location_price_asc", build_avg_price_bar(
+                    "location", True, "📍 Avg Price/m² by Location (ASC)"))
                 st.plotly_chart(fig_loc_asc, width='stretch')
             with col2:
-                fig_loc_desc = px.bar(
-                    avg_price_by_location.sort_values("price_per_m", ascending=False).head(10),
-                    x="location",
-                    y="price_per_m",
-                    title="📍 Avg Price/m² by Location (DESC)",
-                    color="price_per_m",
-                    color_continuous_scale="Plasma",
-                    labels={"location": "Location", "price_per_m": "Price/m² (EGP)"},
-                )
+                fig_loc_desc = cached_figure(view_key, "location_price_desc", build_avg_price_bar(
+                    "location", False, "📍 Avg Price/m² by Location (DESC)"))
                 st.plotly_chart(fig_loc_desc, width='stretch')
 
-        # Price per m² by State (from desktop file)
         if "state" in df.columns and "price_per_m" in df.columns:
             col1, col2 = st.columns(2)
             with col1:
-                avg_price_by_state = df.groupby("state")["price_per_m"].mean().reset_index()
-                fig_state_desc = px.bar(
-                    avg_price_by_state.sort_values("price_per_m", ascending=False).head(10),
-                    x="state",
-                    y="price_per_m",
-                    title="🏙️ Avg Price/m² by State (DESC)",
-                    color="price_per_m",
-                    color_continuous_scale="Plasma",
-                    labels={"state": "State", "price_per_m": "Price/m² (EGP)"},
-                )
+                fig_state_desc = cached_figure(view_key, "state_price_desc", build_avg_price_bar(
+                    "state", False, "🏙️ Avg Price/m² by State (DESC)"))
                 st.plotly_chart(fig_state_desc, width='stretch')
             with col2:
-                fig_state_asc = px.bar(
-                    avg_price_by_state.sort_values("price_per_m", ascending=True).head(10),
-                    x="state",
-                    y="price_per_m",
-                    title="🏙️ Avg Price/m² by State (ASC)",
-                    color="price_per_m",
-                    color_continuous_scale="Plasma",
-                    labels={"state": "State", "price_per_m": "Price/m² (EGP)"},
-                )
+                fig_state_asc = cached_figure(view_key, "state_price_asc", build_avg_price_bar(
+                    "state", True, "🏙️ Avg Price/m² by State (ASC)"))
                 st.plotly_chart(fig_state_asc, width='stretch')
 
         # Property List with Pagination
-        st.markdown("## 📋 Property List")
-
-        search = st.text_input(
-            "🔍 Search properties...", placeholder="Type location or property name..."
-        )
-
-        display_df = df.copy()
-        if search:
-            search_mask = display_df["location"].str.contains(search, case=False, na=False)
-            if "title" in display_df.columns:
-                search_mask |= display_df["title"].str.contains(search, case=False, na=False)
-            display_df = display_df[search_mask]
-
-        # Select columns to display
-        cols_to_show = [
-            "title", "property_type", "price", "location", "state",
-            "bedrooms", "area", "payment_method", "price_per_m",
-        ]
-        available_cols = [c for c in cols_to_show if c in display_df.columns]
-
-        # Pagination
-        items_per_page = 20
-        total_items = len(display_df)
-        total_pages = max(1, (total_items + items_per_page - 1) // items_per_page)
-
-        if "page_number" not in st.session_state:
-            st.session_state.page_number = 1
-
-        col1, col2, col3 = st.columns([1, 3, 1])
-        with col1:
-            if st.button("◀️ Previous", disabled=(st.session_state.page_number <= 1)):
-                st.session_state.page_number = max(1, st.session_state.page_number - 1)
-                st.rerun()
-        with col2:
-            st.markdown(
-                f"<div style='text-align: center; padding: 8px;'>Page {st.session_state.page_number} of {total_pages} ({total_items:,} properties)</div>",
-                unsafe_allow_html=True,
-            )
-        with col3:
-            if st.button("Next ▶️", disabled=(st.session_state.page_number >= total_pages)):
-                st.session_state.page_number = min(total_pages, st.session_state.page_number + 1)
-                st.rerun()
-
-        start_idx = (st.session_state.page_number - 1) * items_per_page
-        end_idx = min(start_idx + items_per_page, total_items)
-
-        st.dataframe(
-            display_df[available_cols].iloc[start_idx:end_idx],
-            width='stretch',
-            hide_index=True,
-            column_config={
-                "price": st.column_config.NumberColumn("Price", format="%d EGP"),
-                "area": st.column_config.NumberColumn("Area", format="%.0f m²"),
-                "price_per_m": st.column_config.NumberColumn("Price/m²", format="%d EGP"),
-            },
-        )
+        render_property_list(df, df_full)
 
-        # Data Export (medium priority)
-        st.markdown("### 📥 Export Data")
-        col1, col2 = st.columns(2)
-        with col1:
-            st.markdown(export_to_csv(display_df), unsafe_allow_html=True)
-        with col2:
-            st.markdown(export_to_excel(display_df), unsafe_allow_html=True)
 
 # ========== Tab 2: Market Insights ==========
-with tab2:
+def render_market_insights(df, df_full, market, view_key):
+    """Tab 2: رؤى السوق و Buy Score"""
     st.markdown("## 📈 Market Insights & Analytics")
 
     insights = load_market_insights()
@@ -1117,40 +2517,42 @@ with tab2:
 
         # Price Distribution
         if not df.empty and "price" in df.columns:
-            fig = px.histogram(
+            fig = cached_figure(view_key, "price_histogram", lambda: histogram_figure(
                 df,
                 x="price",
                 nbins=30,
                 title="💰 Price Distribution",
                 color_discrete_sequence=["#667eea"],
                 labels={"price": "Price (EGP)"},
-            )
+            ))
             st.plotly_chart(fig, width='stretch')
 
         # Price per m² by Location
         if "location" in df.columns and "price_per_m" in df.columns:
-            location_prices = (
-                df.groupby("location")["price_per_m"]
-                .mean()
-                .sort_values(ascending=False)
-                .head(10)
-            )
-            fig = px.bar(
-                x=location_prices.values,
-                y=location_prices.index,
-                orientation="h",
-                title="📍 Top 10 Most Expensive Locations (Price/m²)",
-                color=location_prices.values,
-                color_continuous_scale="Plasma",
-                labels={"x": "Price per m² (EGP)", "y": "Location"},
-            )
+            def build_expensive_locations():
+                location_prices = (
+                    market.mean("location", "price_per_m")
+                    .sort_values(ascending=False)
+                    .head(10)
+                )
+                return px.bar(
+                    x=location_prices.values,
+                    y=location_prices.index,
+                    orientation="h",
+                    title="📍 Top 10 Most Expensive Locations (Price/m²)",
+                    color=location_prices.values,
+                    color_continuous_scale="Plasma",
+                    labels={"x": "Price per m² (EGP)", "y": "Location"},
+                )
+
+            fig = cached_figure(view_key, "expensive_locations", build_expensive_locations)
             st.plotly_chart(fig, width='stretch')
 
     else:
         # Fallback: use local calculations (from desktop file)
         st.info("Using local calculations (API insights unavailable)")
 
-        local_insights = calculate_market_insights(df)
+        local_insights = calculate_market_insights(df, market)
 
         if local_insights:
             col1, col2, col3 = st.columns(3)
@@ -1169,11 +2571,11 @@ with tab2:
 
             # Price Distribution
             if not df.empty and "price" in df.columns:
-                fig = px.histogram(
-                    df, x="price", text_auto=True,
+                fig = cached_figure(view_key, "local_price_histogram", lambda: histogram_figure(
+                    df, x="price", nbins=None, text_auto=True,
                     color_discrete_sequence=["#292C60"],
                     title="Price Distribution",
-                )
+                ))
                 st.plotly_chart(fig, width='stretch')
 
             # Expensive & Affordable Areas
@@ -1195,67 +2597,72 @@ with tab2:
 
         if not df.empty:
             with st.spinner("Calculating Buy Scores..."):
-                rf_model, model_features, prop_map = train_model_once(df)
-                treemap_data = create_treemap_data(df, rf_model, model_features, prop_map)
+                treemap_data, treemap_key = treemap_for_view(df, df_full, market, view_key)
 
             if not treemap_data.empty:
                 # Treemap
-                fig_treemap = px.treemap(
-                    treemap_data,
-                    path=["state", "location"],
-                    values="Price_Per_M_mean",
-                    title="Market Distribution Tree Map مع تقييم المناطق",
-                    color="Buy_Score",
-                    hover_data={
-                        "Price_Per_M_mean": ":.0f",
-                        "Avg_Price": ":.0f",
-                        "Avg_Area": ":.0f",
-                        "Property_Count": True,
-                        "Price_Std": ":.0f",
-                    },
-                    custom_data=[
-                        "Price_Per_M_mean", "Avg_Price", "Avg_Area",
-                        "Property_Count", "Price_Std", "Fair_Price",
-                        "Buy_Score", "Buy_Label",
-                        "area_score", "investment_potential",
-                        "resale_liquidity", "schools_quality",
-                        "Area_Intelligence_Score",
-                    ],
-                )
+                def build_treemap():
+                    fig_treemap = px.treemap(
+                        treemap_data,
+                        path=["state", "location"],
+                        values="Price_Per_M_mean",
+                        title="Market Distribution Tree Map مع تقييم المناطق",
+                        color="Buy_Score",
+                        hover_data={
+                            "Price_Per_M_mean": ":.0f",
+                            "Avg_Price": ":.0f",
+                            "Avg_Area": ":.0f",
+                            "Property_Count": True,
+                            "Price_Std": ":.0f",
+                        },
+                        custom_data=[
+                            "Price_Per_M_mean", "Avg_Price", "Avg_Area",
+                            "Property_Count", "Price_Std", "Fair_Price",
+                            "Buy_Score", "Buy_Label",
+                            "area_score", "investment_potential",
+                            "resale_liquidity", "schools_quality",
+                            "Area_Intelligence_Score",
+                            "Fair_Price_Low", "Fair_Price_High",
+                        ],
+                    )
 
-                # Enhanced hover template
-                fig_treemap.update_traces(
-                    hovertemplate="<b>%{label}</b><br>" +
-                                 "📍 <b>المنطقه:</b> %{parent}<br>" +
-                                 "-------------------<br>" +
-                                 "💰 <b>متوسط سعر المتر:</b> %{customdata[0]:,.0f} EGP<br>" +
-                                 "🏠 <b>متوسط السعر الكلي:</b> %{customdata[1]:,.0f} EGP<br>" +
-                                 "📐 <b>متوسط المساحة:</b> %{customdata[2]:,.0f} m²<br>" +
-                                 "📊 <b>عدد العقارات:</b> %{customdata[3]:,.0f}<br>" +
-                                 "📈 <b>تذبذب الأسعار:</b> %{customdata[4]:,.0f} EGP<br>" +
-                                 "⚖️ <b>السعر العادل:</b> %{customdata[5]:,.0f} EGP<br>" +
-                                 "🏷️ <b>نقاط الشراء:</b> %{customdata[6]:.1f}/100<br>" +
-                                 "📋 <b>التقييم:</b> %{customdata[7]}<br>" +
-                                 "-------------------<br>" +
-                                 "<b>تقييم المنطقة:</b><br>" +
-                                 "• ⭐ <b>التقييم العام:</b> %{customdata[8]:.0f}/100<br>" +
-                                 "• 📈 <b>الإمكانيات الاستثمارية:</b> %{customdata[9]:.0f}/5<br>" +
-                                 "• 💱 <b>سيولة إعادة البيع:</b> %{customdata[10]:.0f}/5<br>" +
-                                 "• 🎓 <b>جودة المدارس:</b> %{customdata[11]:.0f}/5<br>" +
-                                 "<i>انقر للتكبير/التصغير</i>"
-                )
+                    # Enhanced hover template
+                    fig_treemap.update_traces(
+                        hovertemplate="<b>%{label}</b><br>" +
+                                     "📍 <b>المنطقه:</b> %{parent}<br>" +
+                                     "-------------------<br>" +
+                                     "💰 <b>متوسط سعر المتر:</b> %{customdata[0]:,.0f} EGP<br>" +
+                                     "🏠 <b>متوسط السعر الكلي:</b> %{customdata[1]:,.0f} EGP<br>" +
+                                     "📐 <b>متوسط المساحة:</b> %{customdata[2]:,.0f} m²<br>" +
+                                     "📊 <b>عدد العقارات:</b> %{customdata[3]:,.0f}<br>" +
+                                     "📈 <b>تذبذب الأسعار:</b> %{customdata[4]:,.0f} EGP<br>" +
+                                     "⚖️ <b>السعر العادل:</b> %{customdata[5]:,.0f} EGP<br>" +
+                                     "↔️ <b>نطاق السعر العادل:</b> %{customdata[13]:,.0f} – %{customdata[14]:,.0f} EGP<br>" +
+                                     "🏷️ <b>نقاط الشراء:</b> %{customdata[6]:.1f}/100<br>" +
+                                     "📋 <b>التقييم:</b> %{customdata[7]}<br>" +
+                                     "-------------------<br>" +
+                                     "<b>تقييم المنطقة:</b><br>" +
+                                     "• ⭐ <b>التقييم العام:</b> %{customdata[8]:.0f}/100<br>" +
+                                     "• 📈 <b>الإمكانيات الاستثمارية:</b> %{customdata[9]:.0f}/5<br>" +
+                                     "• 💱 <b>سيولة إعادة البيع:</b> %{customdata[10]:.0f}/5<br>" +
+                                     "• 🎓 <b>جودة المدارس:</b> %{customdata[11]:.0f}/5<br>" +
+                                     "<i>انقر للتكبير/التصغير</i>"
+                    )
 
-                fig_treemap.update_layout(
-                    margin=dict(t=50, l=25, r=25, b=20),
-                    coloraxis_colorbar=dict(
-                        title="Buy Score",
-                        thickness=20,
-                        len=0.75,
-                        tickvals=[0, 25, 50, 65, 80, 100],
-                        ticktext=["ضعيف", "سيء", "متوسط", "جيد", "ممتاز", "مثالي"],
-                    ),
-                )
+                    fig_treemap.update_layout(
+                        margin=dict(t=50, l=25, r=25, b=20),
+                        coloraxis_colorbar=dict(
+                            title="Buy Score",
+                            thickness=20,
+                            len=0.75,
+                            tickvals=[0, 25, 50, 65, 80, 100],
+                            ticktext=["ضعيف", "سيء", "متوسط", "جيد", "ممتاز", "مثالي"],
+                        ),
+                    )
+                    return fig_treemap
 
+                # Buy scores change with the model and the area data, not only the filters
+                fig_treemap = cached_figure(treemap_key, "buy_score_treemap", build_treemap)
                 st.plotly_chart(fig_treemap, width='stretch')
 
                 # Buy Score Gauge & Recommendations (from desktop file)
@@ -1312,45 +2719,57 @@ with tab2:
                     st.info(BUY_SCORE_TOOLTIP)
 
                 # Purchase Recommendations
-                recommendations = get_purchase_recommendations(df)
+                recommendations = get_purchase_recommendations(df, market)
                 st.success(f"### ✅ توصيات الشراء:\n" + "\n".join(recommendations))
 
                 # Property Type Distribution Charts (from desktop file)
                 st.markdown("---")
                 st.markdown("### 🏘️ Property Type Analysis")
 
-                local_insights = calculate_market_insights(df)
+                local_insights = calculate_market_insights(df, market)
                 if "property_distribution" in local_insights:
                     prop_data = pd.DataFrame({
                         "Type": list(local_insights["property_distribution"].keys()),
                         "Percentage": list(local_insights["property_distribution"].values()),
                     })
-                    fig_pie_dist = px.pie(
+                    fig_pie_dist = cached_figure(view_key, "type_share_pie", lambda: px.pie(
                         prop_data, values="Percentage", names="Type",
                         title="Property Type Market Distribution",
-                    )
+                    ))
                     st.plotly_chart(fig_pie_dist, width='stretch')
 
                 col7, col8 = st.columns(2)
                 with col7:
                     if "property_type" in df.columns and "price" in df.columns:
-                        avg_price_by_type = df.groupby("property_type")["price"].mean().reset_index()
-                        fig_pie_price = px.pie(
-                            avg_price_by_type, values="price", names="property_type",
+                        fig_pie_price = cached_figure(view_key, "type_price_pie", lambda: px.pie(
+                            market.mean("property_type", "price").reset_index(name="price"),
+                            values="price", names="property_type",
                             title="Average Price by Property Type",
-                        )
+                        ))
                         st.plotly_chart(fig_pie_price, width='stretch')
                 with col8:
                     if "property_type" in df.columns and "price_per_m" in df.columns:
-                        avg_pricem_by_type = df.groupby("property_type")["price_per_m"].mean().reset_index()
-                        fig_pie_pm = px.pie(
-                            avg_pricem_by_type, values="price_per_m", names="property_type",
+                        fig_pie_pm = cached_figure(view_key, "type_price_per_m_pie", lambda: px.pie(
+                            market.mean("property_type", "price_per_m").reset_index(name="price_per_m"),
+                            values="price_per_m", names="property_type",
                             title="Average Price/m² by Property Type",
-                        )
+                        ))
                         st.plotly_chart(fig_pie_pm, width='stretch')
 
+
 # ========== Tab 3: AI Predictions ==========
-with tab3:
+def render_prediction_cache_stats(prediction_cache, from_cache):
+    stats = prediction_cache.stats()
+    source = "⚡ Served from cache" if from_cache else "🧮 Freshly computed"
+    st.caption(
+        f"{source} · cache hit rate {stats['hit_rate']:.0%} "
+        f"({stats['hits']} hits / {stats['misses']} misses, {stats['entries']} entries)"
+    )
+
+
+@st.fragment
+def render_predictor(df_full):
+    """Tab 3: أي تفاعل مع المتنبئ بيعيد تشغيله لوحده"""
     st.markdown("## 🤖 AI Price Predictor")
     st.markdown("Enter property details to get an AI-powered price prediction")
 
@@ -1389,27 +2808,39 @@ with tab3:
     st.markdown("### 🔧 Prediction Method")
     prediction_method = st.radio(
         "Choose prediction source:",
-        ["🌐 API Prediction (Backend)", "🤖 Local ML Model (RandomForest)"],
+        ["🌐 API Prediction (Backend)", f"🤖 Local ML Model ({get_backend().label})"],
         horizontal=True,
     )
 
     if st.button("🔮 Predict Price", width='stretch'):
+        prediction_data = {
+            "area": area_input,
+            "bedrooms": bedrooms_input,
+            "bathrooms": bathrooms_input,
+            "location": location_input,
+            "property_type": property_type_input,
+            "payment_method": payment_input,
+        }
+
         with st.spinner("Calculating prediction..."):
             if prediction_method == "🌐 API Prediction (Backend)":
                 try:
-                    prediction_data = {
-                        "area": area_input,
-                        "bedrooms": bedrooms_input,
-                        "bathrooms": bathrooms_input,
-                        "location": location_input,
-                        "property_type": property_type_input,
-                        "payment_method": payment_input,
-                    }
-
-                    response = requests.post(API_PREDICT, json=prediction_data, timeout=30)
+                    def request_prediction():
+                        response = requests.post(API_PREDICT, json=prediction_data, timeout=30)
+                        if response.status_code != 200:
+                            raise APIError(response.status_code)
+                        return response.json()
+
+                    # The backend may retrain, so its answers are only reused for an hour
+                    prediction_cache = get_prediction_cache("api", ttl=3600)
+                    try:
+                        result, from_cache = prediction_cache.get(
+                            prediction_key("api", API_PREDICT, prediction_data), request_prediction
+                        )
+                    except APIError:
+                        result = None
 
-                    if response.status_code == 200:
-                        result = response.json()
+                    if result is not None:
 
                         st.markdown('<div class="custom-divider"></div>', unsafe_allow_html=True)
 
@@ -1449,6 +2880,7 @@ with tab3:
                         """,
                             unsafe_allow_html=True,
                         )
+                        render_prediction_cache_stats(prediction_cache, from_cache)
                     else:
                         st.error("Failed to get prediction. Please try again.")
                 except Exception as e:
@@ -1462,25 +2894,23 @@ with tab3:
                     if rf_model is None:
                         st.error("⚠️ Local model not available. Need at least 50 properties for training. Try API prediction instead.")
                     else:
-                        # Prepare input
+                        # Prepare input, area intelligence and location prices come from the model's location table
                         input_data = {
+                            "location": location_input,
+                            "property_type": property_type_input,
                             "area": area_input,
                             "bedrooms": bedrooms_input,
                             "bathrooms": bathrooms_input,
-                            "price_per_m": 0,
                             "payment_code": 0 if payment_input == "Cash" else 1,
                             "property_type_code": prop_map.get(property_type_input, 0),
-                            "near_sea": 0,
-                            "schools_quality": 3,
-                            "services_level": 3,
-                            "transportation": 3,
-                            "investment_potential": 3,
-                            "resale_liquidity": 3,
-                            "area_score": 70,
                         }
 
-                        pred_vector = [input_data.get(f, 0) for f in model_features]
-                        predicted_price = rf_model.predict([pred_vector])[0]
+                        # Keyed on the model version, so a retrained model never serves old answers
+                        prediction_cache = get_prediction_cache("local")
+                        (predicted_price, price_lower, price_upper), from_cache = prediction_cache.get(
+                            prediction_key("local", rf_model.version, prediction_data),
+                            lambda: tuple(float(p[0]) for p in rf_model.predict_interval([input_data])),
+                        )
                         predicted_price_per_m = predicted_price / area_input if area_input > 0 else 0
 
                         st.markdown('<div class="custom-divider"></div>', unsafe_allow_html=True)
@@ -1494,6 +2924,7 @@ with tab3:
                                 <h3>🎯 Predicted Price (Local ML)</h3>
                                 <h2>{predicted_price:,.0f} EGP</h2>
                                 <p>💰 {predicted_price_per_m:,.0f} EGP/m²</p>
+                                <p>📊 {PREDICTION_COVERAGE:.0%} range: {price_lower:,.0f} – {price_upper:,.0f} EGP</p>
                             </div>
                             """,
                                 unsafe_allow_html=True,
@@ -1501,11 +2932,18 @@ with tab3:
 
                         with col2:
                             mae = st.session_state.get("model_mae", 0)
+                            location_features = rf_model.frame([input_data]).iloc[0]
+                            location_price = location_features.get("location_price_per_m_te")
+                            location_line = (
+                                f"<p>📍 {location_input} avg: {location_price:,.0f} EGP/m² · Area Score {location_features.get('area_score', 70):.0f}/100</p>"
+                                if location_price is not None else ""
+                            )
                             st.markdown(
                                 f"""
                             <div class="metric-card">
                                 <h3>📊 Model Accuracy</h3>
                                 <p>📉 Mean Absolute Error: {mae:,.0f} EGP</p>
+                                {location_line}
                                 <p>🎯 Features Used: {len(model_features)}</p>
                                 <p>📚 Training Data: {len(df_full)} properties</p>
                             </div>
@@ -1523,12 +2961,16 @@ with tab3:
                         """,
                             unsafe_allow_html=True,
                         )
+                        render_prediction_cache_stats(prediction_cache, from_cache)
 
                 except Exception as e:
                     st.error(f"Local ML Error: {str(e)}")
 
+
 # ========== Tab 4: Time Analysis ==========
-with tab4:
+@st.fragment
+def render_time_analysis(df_full, df, view_key):
+    """Tab 4: اختيار التواريخ والتجميع بيعيد تشغيل التاب ده بس"""
     st.markdown("## ⏰ Time-Based Analysis")
     st.markdown("Analyze property trends over time")
 
@@ -1540,8 +2982,9 @@ with tab4:
         date_col = st.selectbox("Select date column for analysis:", date_columns)
 
         if not df_full.empty and date_col in df_full.columns:
-            df_time = df_full.copy()
-            df_time[date_col] = pd.to_datetime(df_time[date_col], errors='coerce')
+            # The trends below only read these, the rest of df_full stays out of the filtered copy
+            time_columns = {date_col, "price", "area", "price_per_m", "property_type", "payment_method"}
+            df_time = df_full.assign(**{date_col: pd.to_datetime(df_full[date_col], errors='coerce')})
             df_time = df_time.dropna(subset=[date_col])
 
             if not df_time.empty:
@@ -1561,7 +3004,7 @@ with tab4:
                 if len(date_range) == 2:
                     start_date, end_date = date_range
                     mask = (df_time[date_col].dt.date >= start_date) & (df_time[date_col].dt.date <= end_date)
-                    df_time_filtered = df_time[mask]
+                    df_time_filtered = df_time.loc[mask, [c for c in df_time.columns if c in time_columns]]
 
                     if not df_time_filtered.empty:
                         # Time aggregation
@@ -1571,16 +3014,18 @@ with tab4:
                             index=2,
                         )
 
+                        dates = df_time_filtered[date_col].dt
                         if agg_period == "Day":
-                            df_time_filtered["period"] = df_time_filtered[date_col].dt.date
+                            period = dates.date
                         elif agg_period == "Week":
-                            df_time_filtered["period"] = df_time_filtered[date_col].dt.isocalendar().week.astype(str) + "-" + df_time_filtered[date_col].dt.isocalendar().year.astype(str)
+                            period = dates.isocalendar().week.astype(str) + "-" + dates.isocalendar().year.astype(str)
                         elif agg_period == "Month":
-                            df_time_filtered["period"] = df_time_filtered[date_col].dt.to_period("M").astype(str)
+                            period = dates.to_period("M").astype(str)
                         elif agg_period == "Quarter":
-                            df_time_filtered["period"] = df_time_filtered[date_col].dt.to_period("Q").astype(str)
+                            period = dates.to_period("Q").astype(str)
                         else:
-                            df_time_filtered["period"] = df_time_filtered[date_col].dt.year.astype(str)
+                            period = dates.year.astype(str)
+                        df_time_filtered = df_time_filtered.assign(period=period)
 
                         st.markdown("---")
                         st.markdown(f"### 📊 Trends Over Time ({agg_period}ly)")
@@ -1683,28 +3128,31 @@ with tab4:
         st.markdown("Since no date data is available, here's a trend analysis based on property ordering:")
 
         if not df.empty and len(df) > 10:
-            df_sim = df.copy()
-            df_sim["simulated_index"] = range(len(df_sim))
+            def build_simulated_trend(y, title, label):
+                def build():
+                    # Only the plotted column, not a copy of every filtered row
+                    df_sim = df[[y]].assign(simulated_index=np.arange(len(df)))
+                    fig_sim = px.line(
+                        df_sim, x="simulated_index", y=y,
+                        title=title,
+                        labels={"simulated_index": "Property #", y: label},
+                    )
+                    fig_sim.update_layout(height=400)
+                    return fig_sim
+                return build
 
             col1, col2 = st.columns(2)
             with col1:
                 # Price trend by index
-                fig_sim1 = px.line(
-                    df_sim, x="simulated_index", y="price" if "price" in df_sim.columns else None,
-                    title="📈 Price Trend (by entry order)",
-                    labels={"simulated_index": "Property #", "price": "Price (EGP)"},
-                )
-                fig_sim1.update_layout(height=400)
-                st.plotly_chart(fig_sim1, width='stretch')
+                if "price" in df.columns:
+                    fig_sim1 = cached_figure(view_key, "simulated_price_trend", build_simulated_trend(
+                        "price", "📈 Price Trend (by entry order)", "Price (EGP)"))
+                    st.plotly_chart(fig_sim1, width='stretch')
 
             with col2:
-                if "price_per_m" in df_sim.columns:
-                    fig_sim2 = px.line(
-                        df_sim, x="simulated_index", y="price_per_m",
-                        title="📏 Price/m² Trend (by entry order)",
-                        labels={"simulated_index": "Property #", "price_per_m": "Price/m² (EGP)"},
-                    )
-                    fig_sim2.update_layout(height=400)
+                if "price_per_m" in df.columns:
+                    fig_sim2 = cached_figure(view_key, "simulated_price_per_m_trend", build_simulated_trend(
+                        "price_per_m", "📏 Price/m² Trend (by entry order)", "Price/m² (EGP)"))
                     st.plotly_chart(fig_sim2, width='stretch')
 
             st.markdown("""
@@ -1712,103 +3160,175 @@ with tab4:
             > The backend can be updated to track when each property was scraped/added.
             """)
 
+
+# ========== View Router ==========
+with tab1:
+    if tab1.open:
+        with profiled("view:dashboard"):
+            render_dashboard(df, df_full, market, view_key)
+
+with tab2:
+    if tab2.open:
+        with profiled("view:market_insights"):
+            render_market_insights(df, df_full, market, view_key)
+
+with tab3:
+    if tab3.open:
+        with profiled("view:predictor"):
+            render_predictor(df_full)
+
+with tab4:
+    if tab4.open:
+        with profiled("view:time_analysis"):
+            render_time_analysis(df_full, df, view_key)
+
 # ========== Property Comparison Tool (medium priority) ==========
-st.markdown('<div class="custom-divider"></div>', unsafe_allow_html=True)
-with st.expander("🔍 Property Comparison Tool", expanded=False):
-    st.markdown("### 🔍 Compare Properties Side by Side")
-
-    if not df_full.empty and len(df_full) > 1:
-        # Select properties to compare
-        property_options = df_full.apply(
-            lambda row: f"{row.get('title', 'Unknown')} - {row.get('location', '')} - {row.get('price', 0):,.0f} EGP",
-            axis=1
-        ).tolist()
-
-        selected_indices = st.multiselect(
-            "Select 2-4 properties to compare:",
-            options=range(len(property_options)),
-            format_func=lambda i: property_options[i] if i < len(property_options) else "",
-            max_selections=4,
-        )
+COMPARISON_MAX_OPTIONS = 50
 
-        if len(selected_indices) >= 2:
-            compare_df = df_full.iloc[selected_indices]
-
-            # Comparison columns
-            compare_cols = [
-                "title", "property_type", "price", "price_per_m",
-                "area", "bedrooms", "bathrooms", "location",
-                "state", "payment_method",
-            ]
-            available_compare_cols = [c for c in compare_cols if c in compare_df.columns]
-
-            st.markdown("### 📊 Comparison Table")
-            # Transpose for better comparison
-            comparison_table = compare_df[available_compare_cols].T
-            comparison_table.columns = [f"Property {i+1}" for i in range(len(selected_indices))]
-            st.dataframe(comparison_table, width='stretch')
-
-            # Visual comparison
-            st.markdown("### 📈 Visual Comparison")
-            col1, col2 = st.columns(2)
 
-            with col1:
-                if "price" in compare_df.columns:
-                    fig_comp1 = px.bar(
-                        compare_df, x=compare_df.index, y="price",
-                        title="💰 Price Comparison",
-                        color="property_type" if "property_type" in compare_df.columns else None,
-                        text_auto=".0f",
-                        labels={"index": "Property", "price": "Price (EGP)"},
-                    )
-                    fig_comp1.update_layout(height=400)
-                    st.plotly_chart(fig_comp1, width='stretch')
+def comparison_labels(df):
+    """عناوين العقارات في أداة المقارنة (title - location - price)"""
+    def text(col, fallback):
+        if col not in df.columns:
+            return pd.Series(fallback, index=df.index, dtype="object")
+        return df[col].astype("string").fillna(fallback).astype("object")
 
-            with col2:
-                if "price_per_m" in compare_df.columns:
-                    fig_comp2 = px.bar(
-                        compare_df, x=compare_df.index, y="price_per_m",
-                        title="📏 Price/m² Comparison",
-                        color="property_type" if "property_type" in compare_df.columns else None,
-                        text_auto=".0f",
-                        labels={"index": "Property", "price_per_m": "Price/m² (EGP)"},
-                    )
-                    fig_comp2.update_layout(height=400)
-                    st.plotly_chart(fig_comp2, width='stretch')
-
-            # Radar chart for comparison
-            st.markdown("### 🕸️ Property Features Radar")
-            radar_metrics = ["price", "area", "bedrooms", "bathrooms", "price_per_m"]
-            available_radar = [m for m in radar_metrics if m in compare_df.columns]
-
-            if len(available_radar) >= 3:
-                radar_data = compare_df[available_radar].copy()
-                # Normalize for radar
-                for col in radar_data.columns:
-                    if radar_data[col].max() != radar_data[col].min():
-                        radar_data[col] = (radar_data[col] - radar_data[col].min()) / (radar_data[col].max() - radar_data[col].min())
-                    else:
-                        radar_data[col] = 0.5
-
-                fig_radar = go.Figure()
-                for i, idx in enumerate(radar_data.index):
-                    fig_radar.add_trace(go.Scatterpolar(
-                        r=radar_data.loc[idx].tolist() + [radar_data.loc[idx].tolist()[0]],
-                        theta=available_radar + [available_radar[0]],
-                        fill='toself',
-                        name=f"Property {i+1}",
-                    ))
+    if "price" in df.columns:
+        price = pd.to_numeric(df["price"], errors="coerce").fillna(0).round().astype("int64")
+        # Thousands separators on one integer column instead of a Python pass per row
+        price = price.map("{:,}".format)
+    else:
+        price = pd.Series("0", index=df.index, dtype="object")
+    labels = text("title", "Unknown") + " - " + text("location", "") + " - " + price + " EGP"
+    return labels.to_numpy()
+
+
+@st.fragment
+def render_comparison_tool(df_full):
+    """أداة المقارنة: اختيار العقارات بيعيد تشغيل الأداة بس"""
+    # Options are only built while the expander is open
+    with st.expander("🔍 Property Comparison Tool", expanded=False, key="comparison_open", on_change="rerun") as comparison:
+        if not comparison.open:
+            return
+        st.markdown("### 🔍 Compare Properties Side by Side")
+
+        if not df_full.empty and len(df_full) > 1:
+            registry = get_frame_registry()
+            version = registry.version(df_full)
+            property_options = registry.get(df_full, "comparison_labels", comparison_labels)
+
+            # Picks survive new searches, but not a reload of the data
+            saved_version, saved = st.session_state.get("comparison_selection", (None, []))
+            if saved_version != version:
+                saved = []
+
+            query = st.text_input(
+                "Find properties to compare:", placeholder="Type title, location or city...",
+                key="comparison_search",
+            )
+            # Only the current matches go to the browser, never the full list
+            matches = []
+            if query:
+                index = registry.get(df_full, "text_index", PropertyTextIndex)
+                found = index.search(query)
+                matches = found[:COMPARISON_MAX_OPTIONS].tolist()
+                if len(found) > COMPARISON_MAX_OPTIONS:
+                    st.caption(f"Showing the first {COMPARISON_MAX_OPTIONS} of {len(found):,} matches, refine the search to narrow it down.")
+                elif not len(found):
+                    st.caption("No properties match this search.")
+
+            selected_indices = st.multiselect(
+                "Select 2-4 properties to compare:",
+                options=list(dict.fromkeys(saved + matches)),
+                default=saved,
+                format_func=lambda i: property_options[i],
+                max_selections=4,
+            )
+            st.session_state["comparison_selection"] = (version, selected_indices)
 
-                fig_radar.update_layout(
-                    polar=dict(radialaxis=dict(visible=True, range=[0, 1])),
-                    title="Property Features Comparison (Normalized)",
-                    height=500,
-                )
-                st.plotly_chart(fig_radar, width='stretch')
+            if len(selected_indices) >= 2:
+                compare_df = df_full.iloc[selected_indices]
+
+                # Comparison columns
+                compare_cols = [
+                    "title", "property_type", "price", "price_per_m",
+                    "area", "bedrooms", "bathrooms", "location",
+                    "state", "payment_method",
+                ]
+                available_compare_cols = [c for c in compare_cols if c in compare_df.columns]
+
+                st.markdown("### 📊 Comparison Table")
+                # Transpose for better comparison
+                comparison_table = compare_df[available_compare_cols].T
+                comparison_table.columns = [f"Property {i+1}" for i in range(len(selected_indices))]
+                st.dataframe(comparison_table, width='stretch')
+
+                # Visual comparison
+                st.markdown("### 📈 Visual Comparison")
+                col1, col2 = st.columns(2)
+
+                with col1:
+                    if "price" in compare_df.columns:
+                        fig_comp1 = px.bar(
+                            compare_df, x=compare_df.index, y="price",
+                            title="💰 Price Comparison",
+                            color="property_type" if "property_type" in compare_df.columns else None,
+                            text_auto=".0f",
+                            labels={"index": "Property", "price": "Price (EGP)"},
+                        )
+                        fig_comp1.update_layout(height=400)
+                        st.plotly_chart(fig_comp1, width='stretch')
+
+                with col2:
+                    if "price_per_m" in compare_df.columns:
+                        fig_comp2 = px.bar(
+                            compare_df, x=compare_df.index, y="price_per_m",
+                            title="📏 Price/m² Comparison",
+                            color="property_type" if "property_type" in compare_df.columns else None,
+                            text_auto=".0f",
+                            labels={"index": "Property", "price_per_m": "Price/m² (EGP)"},
+                        )
+                        fig_comp2.update_layout(height=400)
+                        st.plotly_chart(fig_comp2, width='stretch')
+
+                # Radar chart for comparison
+                st.markdown("### 🕸️ Property Features Radar")
+                radar_metrics = ["price", "area", "bedrooms", "bathrooms", "price_per_m"]
+                available_radar = [m for m in radar_metrics if m in compare_df.columns]
+
+                if len(available_radar) >= 3:
+                    radar_data = compare_df[available_radar]
+                    # Normalize for radar
+                    for col in radar_data.columns:
+                        if radar_data[col].max() != radar_data[col].min():
+                            radar_data[col] = (radar_data[col] - radar_data[col].min()) / (radar_data[col].max() - radar_data[col].min())
+                        else:
+                            radar_data[col] = 0.5
+
+                    fig_radar = go.Figure()
+                    for i, idx in enumerate(radar_data.index):
+                        fig_radar.add_trace(go.Scatterpolar(
+                            r=radar_data.loc[idx].tolist() + [radar_data.loc[idx].tolist()[0]],
+                            theta=available_radar + [available_radar[0]],
+                            fill='toself',
+                            name=f"Property {i+1}",
+                        ))
+
+                    fig_radar.update_layout(
+                        polar=dict(radialaxis=dict(visible=True, range=[0, 1])),
+                        title="Property Features Comparison (Normalized)",
+                        height=500,
+                    )
+                    st.plotly_chart(fig_radar, width='stretch')
+            else:
+                st.info("Select at least 2 properties to compare.")
         else:
-            st.info("Select at least 2 properties to compare.")
-    else:
-        st.info("Not enough properties loaded for comparison.")
+            st.info("Not enough properties loaded for comparison.")
+
+
+st.markdown('<div class="custom-divider"></div>', unsafe_allow_html=True)
+with profiled("comparison_tool"):
+    render_comparison_tool(df_full)
 
 # Footer
 st.markdown('<div class="custom-divider"></div>', unsafe_allow_html=True)
@@ -1821,3 +3341,5 @@ st.markdown(
     """,
     unsafe_allow_html=True,
 )
+
+render_profiler_panel(profile_run)
@@ -0,0 +1,257 @@
+# area_matching.py - ربط أسماء المناطق في الإعلانات (State/Location) بـ Area_Name في state.csv
+#
+# الإعلانات بتكتب نفس المنطقة بأكتر من شكل (El Mandara / Mandara، Gianaclis / Janaklees)،
+# فالاسم بيتوحد الأول وبعدين بيتقارن بالـ n-grams. جدول النتايج بيتراجع ويتصلح من سطر الأوامر:
+#     python area_matching.py --data Final1.csv --areas state.csv --out area_matches.csv
+# والتصحيحات بتتحط في area_aliases.csv (raw_name,area_name) وبتتقدم على المطابقة التقريبية.
+import argparse
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+
+AREA_ALIASES_PATH = "area_aliases.csv"
+# Lowest similarity accepted as the same area, everything below stays unmatched
+MATCH_THRESHOLD = 0.75
+# Shorter skeleton words ("mr") are too common to count as containing the area
+MIN_SKELETON_WORD = 3
+# A shared skeleton word must also look alike when spelled out (Gleim / Glim, not Amir / Amreya)
+MIN_WORD_SIMILARITY = 0.4
+# Score of a name that contains all of an area's words, plus qualifiers ("Montaza Palace")
+CONTAINS_SCORE = 0.9
+# A segment ending in one of these is a street named after somewhere, not a place in it
+STREET_MARKERS = {"st", "street", "road", "rd"}
+# Articles and district qualifiers that do not tell two areas apart
+# ("Hay Awal El Montazah" is the first district of Montazah)
+AREA_STOPWORDS = {
+    "el", "al", "hay", "the", "district", "awal", "than", "thani", "talet",
+    "bahary", "bahri", "qebli", "gharb", "sharq",
+}
+# Listings reviewed by hand; `python area_matching.py --check` fails if any of them regress
+KNOWN_MATCHES = {
+    "Camp Caesar": "Camp Chezar",
+    "Gianaclis": "Janaklees",
+    "Hay Awal El Montazah": "Montazah",
+    "Al-Montaza Palace": "Montazah",
+    "Gleim Square": "Glim",
+    "Bahray - Anfoshy": "Anfoshy",
+    "Sidi Gaber St.": "Sidi Gaber",
+    "New Borg Al Arab City   Marsa Matrouh Road": "Borg El Arab City",
+    "Amr Al Nogomi St.": "",
+    "Amir Al Behar Hamdy Eldeeb St.": "",
+    "Al Amir Gamil St.": "",
+    "Amir Al Bahr St.": "",
+    "Gaber Abd Al Moaty Al Ghazali St.": "",
+    "Cairo   Borg Al Arab Desert Road": "",
+}
+# Transliteration variants collapse to one letter (Chezar / Caesar, Gianaclis / Janaklees)
+_SKELETON_TABLE = str.maketrans({"c": "k", "q": "k", "g": "j", "z": "s"})
+
+
+def normalize_area_name(name):
+    """اسم المنطقة بحروف صغيرة من غير تشكيل أو علامات أو كلمات زي El/Al/Hay"""
+    text = unicodedata.normalize("NFKD", str(name)).lower()
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    tokens = re.sub(r"[\W_]+", " ", text).split()
+    kept = [t for t in tokens if t not in AREA_STOPWORDS]
+    return " ".join(kept or tokens)
+
+
+def skeleton(normalized):
+    """الحروف الساكنة بس، عشان اختلاف الحروف المتحركة في الترجمة ميفرقش"""
+    words = []
+    for token in normalized.translate(_SKELETON_TABLE).replace("ph", "f").split():
+        rest = re.sub(r"[aeiouyhw]", "", token[1:])
+        words.append(re.sub(r"(.)\1+", r"\1", token[0] + rest))
+    return " ".join(words)
+
+
+def place_segments(name):
+    """أجزاء الاسم (مفصولة بـ , أو - أو مسافات كتير) من غير أسماء الشوارع"""
+    segments = [normalize_area_name(seg) for seg in re.split(r",|\s-\s|\s{2,}", str(name)) if seg.strip()]
+    return [seg for seg in segments if seg and seg.split()[-1] not in STREET_MARKERS]
+
+
+def area_words(normalized):
+    """(الكلمة، الـ skeleton بتاعها) للكلمات اللي طويلة كفاية تميز المنطقة"""
+    pairs = ((word, skeleton(word)) for word in normalized.split())
+    return [(word, skel) for word, skel in pairs if len(skel) >= MIN_SKELETON_WORD]
+
+
+def ngrams(text, n=3):
+    padded = f" {text} "
+    return Counter(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+
+
+def dice(a, b):
+    shared = sum((a & b).values())
+    total = sum(a.values()) + sum(b.values())
+    return 2 * shared / total if total else 0.0
+
+
+class AreaNameMatcher:
+    """فهرس لأسماء المناطق: exact ثم alias ثم n-gram similarity، وكل اسم بيتحل مرة واحدة"""
+
+    def __init__(self, area_names, aliases=None, threshold=MATCH_THRESHOLD):
+        self.area_names = [str(n) for n in area_names]
+        self.threshold = threshold
+        self._exact = {}
+        for area_id, name in enumerate(self.area_names):
+            self._exact.setdefault(name.strip().lower(), area_id)
+            self._exact.setdefault(normalize_area_name(name), area_id)
+
+        # Reviewed corrections; an empty area_name marks a name as "no match"
+        self._aliases = {}
+        for raw, area in (aliases or {}).items():
+            target = self._exact.get(str(area).strip().lower()) if str(area).strip() else -1
+            if target is not None:
+                self._aliases[normalize_area_name(raw)] = target
+
+        # Inverted n-gram index over plain and skeleton spellings of every area
+        self._grams = []
+        self._postings = defaultdict(set)
+        for area_id, name in enumerate(self.area_names):
+            normalized = normalize_area_name(name)
+            grams = (ngrams(normalized), ngrams(skeleton(normalized)), area_words(normalized))
+            self._grams.append(grams)
+            for gram in list(grams[0]) + list(grams[1]):
+                self._postings[gram].add(area_id)
+
+        self._resolved = {}  # raw name -> (area id or -1, score, method)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.area_names)
+
+    def resolve(self, name):
+        """رقم المنطقة (أو -1) ودرجة التشابه وطريقة المطابقة"""
+        key = str(name)
+        hit = self._resolved.get(key)
+        if hit is None:
+            hit = self._match(key)
+            with self._lock:
+                self._resolved[key] = hit
+        return hit
+
+    def resolve_many(self, names):
+        return [self.resolve(n)[0] for n in names]
+
+    def _match(self, name):
+        if name in ("", "nan", "None"):
+            return -1, 0.0, "empty"
+        raw = name.strip().lower()
+        normalized = normalize_area_name(name)
+        if normalized in self._aliases:
+            return self._aliases[normalized], 1.0, "alias"
+        for key in (raw, normalized):
+            if key in self._exact:
+                return self._exact[key], 1.0, "exact"
+
+        # Street segments are dropped ("New Borg Al Arab City, Marsa Matrouh Road");
+        # a name that is only a street can still match fuzzily but never by containment
+        place = " ".join(place_segments(name))
+        text = place or normalized
+        plain, skel = ngrams(text), ngrams(skeleton(text))
+        words = area_words(place)
+        candidates = set()
+        for gram in list(plain) + list(skel):
+            candidates |= self._postings.get(gram, set())
+
+        best, best_rank = (-1, 0.0, "unmatched"), (0.0, 0)
+        for area_id in candidates:
+            area_plain, area_skel, area_tokens = self._grams[area_id]
+            score = max(dice(plain, area_plain), dice(skel, area_skel))
+            method = "fuzzy"
+            # "Hay Awal El Montazah", "Al-Montaza Palace": every word of the area, spelled alike
+            if area_tokens and score < CONTAINS_SCORE and all(
+                any(skel_word == area_skel_word and dice(ngrams(word), ngrams(area_word)) >= MIN_WORD_SIMILARITY
+                    for word, skel_word in words)
+                for area_word, area_skel_word in area_tokens
+            ):
+                score, method = CONTAINS_SCORE, "contains"
+            # Ties go to the area with more words (Borg El Arab City over Borg El Arab)
+            rank = (round(score, 3), len(area_tokens))
+            if rank > best_rank:
+                best, best_rank = (area_id, round(score, 3), method), rank
+        if best[1] < self.threshold:
+            return -1, best[1], "unmatched"
+        return best
+
+    def resolution_table(self, counts=None):
+        """كل اسم اتحل والمنطقة اللي اتربط بيها، عشان حد يراجعه"""
+        with self._lock:
+            resolved = dict(self._resolved)
+        rows = [
+            {
+                "raw_name": raw,
+                "normalized": normalize_area_name(raw),
+                "area_name": self.area_names[area_id] if area_id >= 0 else "",
+                "score": score,
+                "method": method,
+                "listings": int(counts.get(raw, 0)) if counts is not None else None,
+            }
+            for raw, (area_id, score, method) in resolved.items()
+        ]
+        table = pd.DataFrame(rows, columns=["raw_name", "normalized", "area_name", "score", "method", "listings"])
+        # Least certain matches first, they are the ones worth reviewing
+        return table.sort_values(["score", "listings"], ascending=[True, False], ignore_index=True)
+
+
+def load_aliases(path=AREA_ALIASES_PATH):
+    """تصحيحات المراجعة (raw_name -> area_name)، لو الملف مش موجود مفيش تصحيحات"""
+    if not path or not os.path.exists(path):
+        return {}
+    aliases = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return dict(zip(aliases["raw_name"], aliases["area_name"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Review how listing areas map to state.csv")
+    parser.add_argument("--data", default="Final1.csv")
+    parser.add_argument("--areas", default="state.csv")
+    parser.add_argument("--aliases", default=AREA_ALIASES_PATH)
+    parser.add_argument("--columns", nargs="+", default=["State", "Location"])
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD)
+    parser.add_argument("--out", help="write the resolution table as CSV")
+    parser.add_argument("--check", action="store_true", help="only check the KNOWN_MATCHES regression cases")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        matcher = AreaNameMatcher(pd.read_csv(args.areas)["Area_Name"], threshold=args.threshold)
+        failed = 0
+        for raw, expected in KNOWN_MATCHES.items():
+            area_id, score, method = matcher.resolve(raw)
+            got = matcher.area_names[area_id] if area_id >= 0 else ""
+            if got != expected:
+                failed += 1
+                print(f"❌ {raw!r}: expected {expected or 'no match'!r}, got {got or 'no match'!r} ({method} {score})")
+        print(f"{'✅' if not failed else '❌'} {len(KNOWN_MATCHES) - failed}/{len(KNOWN_MATCHES)} known matches")
+        return 1 if failed else 0
+
+    listings = pd.read_csv(args.data)
+    matcher = AreaNameMatcher(pd.read_csv(args.areas)["Area_Name"], load_aliases(args.aliases), args.threshold)
+    counts = Counter()
+    for column in [c for c in args.columns if c in listings.columns]:
+        names = listings[column].astype(str)
+        counts.update(names.value_counts().to_dict())
+        matcher.resolve_many(names.unique())
+
+    table = matcher.resolution_table(counts)
+    matched = table[table["area_name"] != ""]
+    print(f"🗺️ {len(matched)}/{len(table)} names matched to {len(matcher)} areas "
+          f"({matched['listings'].sum():,} of {table['listings'].sum():,} name occurrences)")
+    if args.out:
+        table.to_csv(args.out, index=False)
+        print(f"💾 Resolution table saved to {args.out}")
+    else:
+        print(table[table["method"] != "unmatched"].to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
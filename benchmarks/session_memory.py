@@ -0,0 +1,247 @@
+# benchmarks/session_memory.py - أقصى RSS لجلسة الداشبورد على بيانات كبيرة، قبل وبعد أي تغيير
+#
+# بيشغل API وهمي بيرجع Final1.csv متكرر لحد --rows صف (ومعاه عمود تاريخ عشان Time Analysis)،
+# وبيفتح الداشبورد بـ AppTest ويلف على التابات الأربعة، كل نسخة في process لوحدها:
+#     python benchmarks/session_memory.py --rows 100000
+#     python benchmarks/session_memory.py --rows 100000 --ref HEAD~1 --json memory.json
+# --ref (ممكن يتكرر) بيقارن الشجرة الحالية بأي revision في git. الأرقام من ru_maxrss، فالسكريبت ده للينكس بس.
+# الـ peak بيتغير حوالي 20 MB من تشغيل للتاني (تدريب النموذج على كل الـ cores)، فالمقارنة بالـ median.
+import argparse
+import glob
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    from pyarrow import ipc
+except ImportError:
+    pa = None
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_BASE_URL = '"http://65.75.201.173:8000"'
+VIEWS = ["📈 Market Insights", "🤖 AI Predictions", "⏰ Time Analysis", "📊 Dashboard"]
+# Final1.csv columns -> the names the /properties endpoint returns
+API_COLUMNS = {
+    "Title": "title", "Link": "link", "PropertyType": "property_type", "Price": "price",
+    "Location": "location", "State": "state", "Bedrooms": "bedrooms", "Bathrooms": "bathrooms",
+    "Area": "area", "Down_Payment": "down_payment", "Payment_Method": "payment_method",
+    "Price_Per_M": "price_per_m",
+}
+
+
+# ========== Mock API ==========
+def synthetic_listings(data_path, rows, seed=0):
+    """Final1.csv متكرر لحد rows صف، بلينكات مختلفة وأسعار متغيرة شوية وتاريخ نشر"""
+    rng = np.random.default_rng(seed)
+    df = pd.read_csv(data_path).rename(columns=API_COLUMNS)
+    df = df.sample(rows, replace=True, random_state=seed).reset_index(drop=True)
+    return df.assign(
+        link=df["link"].astype(str) + "?copy=" + df.index.astype(str),
+        price=(df["price"] * rng.uniform(0.9, 1.1, rows)).round(),
+        listed_date=(pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 600, rows), unit="D"))
+        .strftime("%Y-%m-%d"),
+    )
+
+
+def start_mock_api(listings, areas):
+    """نفس endpoints الـ API اللي الداشبورد بيستخدمها، على port فاضي"""
+    averages = {
+        "total_properties": len(listings),
+        "average_price": float(listings["price"].mean()),
+        "average_area": float(listings["area"].mean()),
+    }
+    price_per_m = float(listings["price_per_m"].mean())
+
+    class MockHandler(BaseHTTPRequestHandler):
+        def _send(self, body, content_type="application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = urllib.parse.urlparse(self.path).path
+            if path.endswith("/properties"):
+                if pa is not None and "arrow" in self.headers.get("Accept", ""):
+                    table = pa.Table.from_pandas(listings, preserve_index=False)
+                    sink = io.BytesIO()
+                    with ipc.new_stream(sink, table.schema) as writer:
+                        writer.write_table(table)
+                    return self._send(sink.getvalue(), "application/vnd.apache.arrow.stream")
+                return self._send({"properties": listings.to_dict("records")})
+            if path.endswith("/area-intelligence"):
+                return self._send(areas.to_dict("records"))
+            if path.endswith("/stats/summary"):
+                return self._send(averages)
+            if path.endswith("/insights/market"):
+                return self._send({})
+            self.send_error(404)
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            price = float(payload.get("area", 100)) * price_per_m
+            self._send({
+                "predicted_price": price, "predicted_price_per_m": price_per_m,
+                "confidence_lower": price * 0.9, "confidence_upper": price * 1.1,
+                "area_intelligence_score": 70, "recommendation": "benchmark",
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, name="mock-api", daemon=True).start()
+    return server
+
+
+# ========== App copies ==========
+def prepare_app(target_dir, ref=None):
+    """نسخة من الداشبورد (الشجرة الحالية أو revision في git) في فولدر مؤقت"""
+    os.makedirs(target_dir, exist_ok=True)
+    if ref is None:
+        for path in glob.glob(os.path.join(REPO_DIR, "*.py")) + glob.glob(os.path.join(REPO_DIR, "*.csv")):
+            shutil.copy(path, target_dir)
+        return target_dir
+    listed = subprocess.run(
+        ["git", "ls-tree", "--name-only", ref], cwd=REPO_DIR, check=True, capture_output=True, text=True
+    ).stdout.split()
+    for name in [n for n in listed if n.endswith((".py", ".csv"))]:
+        content = subprocess.run(["git", "show", f"{ref}:{name}"], cwd=REPO_DIR, check=True, capture_output=True).stdout
+        with open(os.path.join(target_dir, name), "wb") as f:
+            f.write(content)
+    return target_dir
+
+
+def point_at(app_dir, api_url):
+    path = os.path.join(app_dir, "app.py")
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    if API_BASE_URL not in source:
+        raise SystemExit(f"❌ {path} has no API_BASE_URL = {API_BASE_URL} to redirect")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(source.replace(API_BASE_URL, json.dumps(api_url)))
+
+
+# ========== Sessions ==========
+def rss_mb():
+    with open("/proc/self/status") as f:
+        return int(f.read().split("VmRSS:")[1].split()[0]) / 1024
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_session(app_path):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=900)
+    at.run()
+    for view in VIEWS:
+        at.session_state["active_view"] = view
+        at.run()
+        if at.exception:
+            raise RuntimeError(f"{view}: {at.exception[0].value}")
+    return at
+
+
+def worker(app_dir, sessions):
+    """بيتشغل في process لوحده عشان الـ peak RSS يبقى بتاع النسخة دي بس"""
+    os.chdir(app_dir)
+    sys.path.insert(0, app_dir)
+    result = {"baseline_mb": round(rss_mb(), 1), "sessions": []}
+    kept = []  # Sessions stay alive, like browser tabs that are still open
+    for _ in range(sessions):
+        start = time.perf_counter()
+        kept.append(run_session(os.path.join(app_dir, "app.py")))
+        result["sessions"].append({
+            "seconds": round(time.perf_counter() - start, 1),
+            "rss_mb": round(rss_mb(), 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        })
+    print(json.dumps(result))
+    return 0
+
+
+def measure(label, app_dir, sessions):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", app_dir, "--sessions", str(sessions)],
+        capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"❌ {label} failed:\n{completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["label"] = label
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Peak RSS of dashboard sessions on a large dataset")
+    parser.add_argument("--data", default=os.path.join(REPO_DIR, "Final1.csv"))
+    parser.add_argument("--areas", default=os.path.join(REPO_DIR, "state.csv"))
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--sessions", type=int, default=2, help="sessions per process, the first one is cold")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh processes per version, compared by median")
+    parser.add_argument("--ref", action="append", default=[], help="git revision to compare against (repeatable)")
+    parser.add_argument("--json", help="write the results as JSON")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return worker(args.worker, args.sessions)
+
+    areas = pd.read_csv(args.areas)
+    areas.columns = [c.lower() for c in areas.columns]
+    server = start_mock_api(synthetic_listings(args.data, args.rows), areas)
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"🧪 Mock API with {args.rows:,} listings on {api_url}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        targets = [("working tree", None)] + [(ref, ref) for ref in args.ref]
+        for label, ref in targets:
+            app_dir = prepare_app(os.path.join(tmp, label.replace(" ", "_").replace("/", "_")), ref)
+            point_at(app_dir, api_url)
+            for run in range(args.repeat):
+                print(f"⏱️ {label} run {run + 1}/{args.repeat}: {args.sessions} session(s) over {len(VIEWS)} views...")
+                results.append(measure(label, app_dir, args.sessions))
+    server.shutdown()
+
+    rows = pd.DataFrame([
+        {"version": r["label"], "session": i + 1, **s, "baseline_mb": r["baseline_mb"]}
+        for r in results for i, s in enumerate(r["sessions"])
+    ])
+    summary = rows.groupby(["version", "session"], sort=False).agg(
+        runs=("peak_rss_mb", "size"),
+        peak_rss_mb=("peak_rss_mb", "median"),
+        peak_min=("peak_rss_mb", "min"),
+        peak_max=("peak_rss_mb", "max"),
+        rss_mb=("rss_mb", "median"),
+        seconds=("seconds", "median"),
+    )
+    print(summary.to_string())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": args.rows, "results": results}, f, indent=2)
+        print(f"💾 Results saved to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
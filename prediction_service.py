@@ -0,0 +1,247 @@
+# prediction_service.py - سيرفر محلي لتوقع الأسعار بيجمّع الطلبات اللي جاية مع بعض في batch واحد
+#
+#     python price_model.py train --out price_model.pkl
+#     python prediction_service.py --artifact price_model.pkl --port 8001
+#     PREDICT_URL=http://127.0.0.1:8001/predict streamlit run app.py
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from area_matching import AREA_ALIASES_PATH, load_aliases
+from price_model import (
+    AreaFeatureTable, IncrementalPriceModel, get_backend, load_dataset, load_model, save_model,
+)
+
+
+# How long the first request of a batch waits for others to join it
+BATCH_WINDOW_SECONDS = 0.005
+MAX_BATCH_SIZE = 256
+REQUEST_TIMEOUT_SECONDS = 30
+# Same payload the backend's /real-estate/predict takes
+REQUIRED_FIELDS = ["area", "bedrooms", "bathrooms", "location", "property_type", "payment_method"]
+PREDICT_PATHS = {"/predict", "/real-estate/predict"}
+
+
+class MicroBatcher:
+    """بيجمع الطلبات اللي بتوصل في نفس الوقت ويتوقعها كلها بـ predict واحد"""
+
+    def __init__(self, model, window=BATCH_WINDOW_SECONDS, max_batch=MAX_BATCH_SIZE):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "largest_batch": 0, "split_batches": 0, "predict_seconds": 0.0}
+        threading.Thread(target=self._run, name="micro-batcher", daemon=True).start()
+
+    def submit(self, payload):
+        future = Future()
+        self._queue.put((payload, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._predict(batch)
+
+    def _predict(self, batch):
+        payloads = [payload for payload, _ in batch]
+        start = time.perf_counter()
+        split = False
+        try:
+            results = self._predict_rows(payloads)
+        except Exception:
+            # One bad row fails the whole predict call, so each request is retried on its own
+            # and only the bad ones get the error
+            split = len(batch) > 1
+            results = []
+            for payload in payloads:
+                try:
+                    results.append(self._predict_rows([payload])[0])
+                except Exception as e:
+                    results.append(e)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            self.stats["split_batches"] += int(split)
+            self.stats["predict_seconds"] += elapsed
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _predict_rows(self, payloads):
+        features = self.model.frame(pd.DataFrame(payloads))
+        price, lower, upper = self.model.predict_interval(features)
+        area_scores = features["area_score"] if "area_score" in features.columns else None
+        return [
+            prediction_response(
+                payload, price[i], lower[i], upper[i],
+                float(area_scores.iloc[i]) if area_scores is not None else None, self.model,
+            )
+            for i, payload in enumerate(payloads)
+        ]
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["avg_batch"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0
+        stats["predict_seconds"] = round(stats["predict_seconds"], 3)
+        return stats
+
+
+def prediction_response(payload, price, lower, upper, area_score, model):
+    """نفس شكل رد الـ API عشان Tab 3 يستخدمه زي ما هو"""
+    area = float(payload["area"])
+    return {
+        "predicted_price": round(float(price), 2),
+        "predicted_price_per_m": round(float(price) / area, 2) if area > 0 else 0,
+        "confidence_lower": round(float(lower), 2),
+        "confidence_upper": round(float(upper), 2),
+        "area_intelligence_score": round(area_score) if area_score is not None else None,
+        "recommendation": (
+            f"A {str(payload['property_type']).lower()} in {payload['location']} with "
+            f"{payload['bedrooms']} bedrooms is expected between {float(lower):,.0f} and {float(upper):,.0f} EGP."
+        ),
+        "model": model.backend.name,
+    }
+
+
+def validate_payload(payload):
+    if not isinstance(payload, dict):
+        return "Body must be a JSON object"
+    missing = [f for f in REQUIRED_FIELDS if payload.get(f) in (None, "")]
+    if missing:
+        return f"Missing fields: {', '.join(missing)}"
+    for field in ("area", "bedrooms", "bathrooms"):
+        try:
+            float(payload[field])
+        except (TypeError, ValueError):
+            return f"{field} must be a number"
+    for field in ("location", "property_type", "payment_method"):
+        if not isinstance(payload[field], str):
+            return f"{field} must be a string"
+    return None
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default backlog of 5 drops connections under a burst of users
+    request_queue_size = 256
+
+
+def make_handler(batcher, started_at):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        server_version = "PricePredictionService/1.0"
+
+        def _send_json(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send_json(404, {"detail": "Not found"})
+            self._send_json(200, {
+                "status": "ok",
+                "model": batcher.model.backend.name,
+                "mae": round(float(batcher.model.mae), 2) if batcher.model.mae is not None else None,
+                "uptime_seconds": round(time.time() - started_at, 1),
+                **batcher.snapshot(),
+            })
+
+        def do_POST(self):
+            if self.path not in PREDICT_PATHS:
+                return self._send_json(404, {"detail": "Not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"null")
+            except (ValueError, json.JSONDecodeError):
+                return self._send_json(400, {"detail": "Invalid JSON body"})
+
+            error = validate_payload(payload)
+            if error:
+                return self._send_json(422, {"detail": error})
+            try:
+                result = batcher.submit(payload).result(timeout=REQUEST_TIMEOUT_SECONDS)
+            except Exception as e:
+                return self._send_json(500, {"detail": f"Prediction failed: {e}"})
+            self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            # One line per request is too noisy under load
+            pass
+
+    return PredictionHandler
+
+
+def load_or_train(args):
+    if os.path.exists(args.artifact):
+        print(f"📦 Loading model from {args.artifact}")
+        return load_model(args.artifact)
+
+    print(f"🔧 {args.artifact} not found, training on {args.data}")
+    area_df = load_dataset(args.areas) if args.areas and os.path.exists(args.areas) else pd.DataFrame()
+    price_model = IncrementalPriceModel(get_backend(args.backend))
+    price_model.update(load_dataset(args.data), AreaFeatureTable(area_df, load_aliases(args.aliases)))
+    fitted = price_model.snapshot()
+    if fitted is None:
+        raise SystemExit("❌ Not enough properties to train a model (need at least 50)")
+    save_model(fitted, args.artifact)
+    return fitted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local price prediction service")
+    parser.add_argument("--artifact", default="price_model.pkl")
+    parser.add_argument("--data", default="Final1.csv", help="used to train when the artifact is missing")
+    parser.add_argument("--areas", default="state.csv")
+    parser.add_argument("--aliases", default=AREA_ALIASES_PATH)
+    parser.add_argument("--backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_SECONDS * 1000)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    model = load_or_train(args)
+    batcher = MicroBatcher(model, window=args.batch_window_ms / 1000, max_batch=args.max_batch)
+    server = PredictionServer((args.host, args.port), make_handler(batcher, time.time()))
+
+    print(f"🚀 {model.backend.label} serving on http://{args.host}:{args.port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️ Stopped")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
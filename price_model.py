@@ -0,0 +1,841 @@
+# price_model.py - نموذج توقع الأسعار: تجهيز الـ features والـ backends والتحديث التدريجي
+#
+# بيشتغل من جوه التطبيق (app.py) أو لوحده من سطر الأوامر:
+#     python price_model.py train --data Final1.csv --out price_model.pkl
+#     python price_model.py benchmark --data Final1.csv --areas state.csv
+#     python price_model.py evaluate --data Final1.csv --folds 5 --segment property_type
+import argparse
+import copy
+import json
+import os
+import pickle
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.metrics import mean_absolute_error
+from sklearn.model_selection import GroupKFold, GroupShuffleSplit, KFold, TimeSeriesSplit, train_test_split
+
+from area_matching import AREA_ALIASES_PATH, AreaNameMatcher, load_aliases
+
+
+AREA_FEATURES = [
+    "near_sea", "schools_quality", "services_level",
+    "transportation", "investment_potential", "resale_liquidity", "area_score",
+]
+NUMERIC_FEATURES = [
+    "area", "bedrooms", "bathrooms",
+    "payment_code", "property_type_code",
+] + AREA_FEATURES
+# Derived from the target (price_per_m = price / area), never allowed as features
+LEAKY_COLUMNS = {"price", "price_per_m", "down_payment"}
+CATEGORICAL_FEATURES = ["location", "state", "property_type"]
+# Smoothed mean price/m² of the listing's location and state (out-of-fold while training)
+TARGET_ENCODED_FEATURES = ["location_price_per_m_te", "state_price_per_m_te"]
+TARGET_ENCODING_KEYS = {"location_price_per_m_te": "te_location", "state_price_per_m_te": "te_state"}
+# Listings needed before a location's own mean outweighs the overall mean
+TARGET_ENCODING_SMOOTHING = 10
+# Value used for a feature the caller did not provide
+FEATURE_DEFAULTS = {"near_sea": 0, "area_score": 70, **{f: 3 for f in AREA_FEATURES[1:-1]}}
+PAYMENT_CODES = {"Cash": 0, "Installments": 1, "نقدي": 0, "تقسيط": 1}
+
+# Rarer categories are folded into "Other" (binned GBDTs cap the categories per feature)
+MAX_CATEGORIES = 200
+OTHER_CATEGORY = "Other"
+
+# A refresh bigger than this share of new listings is a full refit, not an increment
+INCREMENTAL_MAX_NEW_FRACTION = 0.25
+# Allowed rise of the MAE on new listings before the model counts as drifted
+MODEL_DRIFT_TOLERANCE = 0.15
+# ...and the rise must also be this many standard errors, so a handful of new listings is not drift
+MODEL_DRIFT_Z = 2.0
+
+# Share of prices the prediction interval should cover
+PREDICTION_COVERAGE = 0.8
+# Held-out conformity scores kept per model to calibrate intervals
+CALIBRATION_SAMPLE = 2000
+
+
+def snake_case_columns(df):
+    """أسماء الأعمدة بنفس شكل الـ API (PropertyType -> property_type)"""
+    def snake(name):
+        name = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", str(name))
+        return name.lower()
+    return df.rename(columns=snake)
+
+
+def load_dataset(path):
+    """قراءة Final1.csv أو state.csv بأسماء أعمدة الـ API"""
+    return snake_case_columns(pd.read_csv(path))
+
+
+class AreaFeatureTable:
+    """خصائص المناطق في array واحد: كل اسم منطقة ليه صف، والربط بيبقى take بدل merge"""
+
+    # Columns of the area data that can key a listing, in order of preference
+    KEY_COLUMNS = ["area_name", "state", "location"]
+    # Listing columns tried in turn when the listings carry no area_name
+    LISTING_COLUMNS = ["state", "location"]
+
+    def __init__(self, area_df, aliases=None):
+        self.key = next((c for c in self.KEY_COLUMNS if c in area_df.columns), None)
+        self.columns = [c for c in AREA_FEATURES if c in area_df.columns] if self.key else []
+        rows = area_df.drop_duplicates(self.key) if self.columns else pd.DataFrame()
+        # Spelling variants of the listings are resolved to these rows once per distinct name
+        self.matcher = AreaNameMatcher(rows[self.key] if self.columns else [], aliases)
+        values = rows.reindex(columns=self.columns).apply(pd.to_numeric, errors="coerce")
+        # Last row is all NaN, so unmatched listings can be told apart and filled
+        self.values = np.vstack([values.to_numpy(dtype=float), np.full((1, len(self.columns)), np.nan)])
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def row_positions(self, series):
+        """رقم صف المنطقة لكل عقار (آخر صف لو مش موجودة)"""
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
+        # One lookup per distinct name, then a code -> row array covers every listing
+        code_to_row = np.array(self.matcher.resolve_many(uniques), dtype=np.intp)
+        code_to_row = np.append(np.where(code_to_row < 0, len(self), code_to_row), len(self))
+        return code_to_row.take(codes)
+
+    def enrich(self, df):
+        keys = [self.key] if self.key in df.columns else [c for c in self.LISTING_COLUMNS if c in df.columns]
+        positions = np.full(len(df), len(self), dtype=np.intp)
+        for key in keys if len(self) else []:
+            # A listing whose state is unknown may still name a known area as its location
+            missing = positions == len(self)
+            positions[missing] = self.row_positions(df[key])[missing]
+        values = self.values.take(positions, axis=0)
+
+        columns = {}
+        for i, col in enumerate(self.columns):
+            column = values[:, i]
+            matched = ~np.isnan(column)
+            # Unmatched listings get the median of the matched ones, like the old merge + fillna
+            fill = np.median(column[matched]) if matched.any() else FEATURE_DEFAULTS[col]
+            columns[col] = np.where(matched, column, fill)
+        for col in AREA_FEATURES:
+            columns.setdefault(col, FEATURE_DEFAULTS[col])
+        # assign() adds the columns without copying the listing data itself
+        return df.assign(**columns)
+
+
+def area_feature_table(areas):
+    return areas if isinstance(areas, AreaFeatureTable) else AreaFeatureTable(areas)
+
+
+def enrich_with_area_features(df, areas):
+    """ربط بيانات العقارات بخصائص المنطقة (areas: DataFrame أو AreaFeatureTable جاهز)"""
+    return area_feature_table(areas).enrich(df)
+
+
+# ========== Backends ==========
+class RandomForestBackend:
+    """RandomForest على features رقمية بس (property_type كـ label encoding)"""
+
+    name = "random_forest"
+    label = "RandomForest"
+    categorical = False
+    n_estimators = 150
+    # New trees fit on the refreshed data next to the existing ones
+    grows = True
+    # Past this many trees the forest is refit from scratch instead of growing further
+    max_size = 400
+
+    def build(self):
+        return RandomForestRegressor(
+            n_estimators=self.n_estimators, max_depth=20, random_state=47, n_jobs=-1
+        )
+
+    def fit(self, estimator, X, y):
+        estimator.fit(X, y)
+
+    def predict(self, estimator, X):
+        return estimator.predict(X)
+
+    def _tree_band(self, estimator, X):
+        # All trees in one pass over estimators_, then quantiles across trees for every row
+        X = np.ascontiguousarray(X.to_numpy(dtype=np.float32))
+        per_tree = np.stack([tree.predict(X, check_input=False) for tree in estimator.estimators_])
+        alpha = (1 - PREDICTION_COVERAGE) / 2
+        lower, upper = np.quantile(per_tree, [alpha, 1 - alpha], axis=0)
+        return per_tree.mean(axis=0), np.maximum(lower, 1.0), np.maximum(upper, 1.0)
+
+    def calibration_scores(self, estimator, X, y):
+        # Trees agree more than prices vary, so the band is conformalized (CQR) in log space
+        _, lower, upper = self._tree_band(estimator, X)
+        log_y = np.log(np.asarray(y, dtype=float))
+        return np.maximum(np.log(lower) - log_y, log_y - np.log(upper))
+
+    def predict_interval(self, estimator, X, scores, coverage):
+        price, lower, upper = self._tree_band(estimator, X)
+        widen = np.quantile(scores, coverage) if len(scores) else 0.0
+        return price, lower * np.exp(-widen), upper * np.exp(widen)
+
+    def size(self, estimator):
+        return estimator.n_estimators
+
+    def grow(self, estimator, new_fraction):
+        # warm_start only fits the added trees on the next fit() call
+        extra = max(10, int(np.ceil(self.n_estimators * new_fraction)))
+        estimator.set_params(warm_start=True, n_estimators=estimator.n_estimators + extra)
+        return f"+{extra} trees"
+
+
+class HistGradientBoostingBackend:
+    """Gradient boosting على bins، location/state/type كـ categorical من غير encoding"""
+
+    name = "hist_gradient_boosting"
+    label = "HistGradientBoosting"
+    categorical = True
+    max_iter = 300
+    # warm_start on changed data refits the bin mapper, and the existing trees then split
+    # on the wrong thresholds, so every refresh is a full refit
+    grows = False
+
+    def build(self):
+        return HistGradientBoostingRegressor(
+            max_iter=self.max_iter, learning_rate=0.1,
+            categorical_features="from_dtype", early_stopping=False, random_state=47,
+        )
+
+    # Prices are heavy-tailed, so the boosting runs on log(price)
+    def fit(self, estimator, X, y):
+        estimator.fit(X, np.log(y))
+
+    def predict(self, estimator, X):
+        return np.exp(estimator.predict(X))
+
+    def calibration_scores(self, estimator, X, y):
+        return np.log(np.asarray(y, dtype=float)) - estimator.predict(X)
+
+    def predict_interval(self, estimator, X, scores, coverage):
+        # Split-conformal: held-out log errors of this model around the point estimate
+        log_price = estimator.predict(X)
+        alpha = (1 - coverage) / 2
+        low, high = np.quantile(scores, [alpha, 1 - alpha]) if len(scores) else (0.0, 0.0)
+        return np.exp(log_price), np.exp(log_price + low), np.exp(log_price + high)
+
+
+MODEL_BACKENDS = {
+    backend.name: backend
+    for backend in (RandomForestBackend(), HistGradientBoostingBackend())
+}
+DEFAULT_BACKEND = os.environ.get("PRICE_MODEL_BACKEND", RandomForestBackend.name)
+
+
+def assert_leakage_free(features):
+    leaked = sorted(LEAKY_COLUMNS.intersection(features))
+    if leaked:
+        raise ValueError(f"Features derived from the price would leak the target: {', '.join(leaked)}")
+
+
+def get_backend(name=None):
+    name = name or DEFAULT_BACKEND
+    if name not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown price model backend: {name} (choose from {', '.join(MODEL_BACKENDS)})")
+    return MODEL_BACKENDS[name]
+
+
+# ========== Features ==========
+def category_levels(series, levels=None):
+    """أكتر القيم تكرارًا، والباقي بيبقى Other"""
+    if levels is not None:
+        return levels
+    top = series.dropna().astype(str).value_counts().index[:MAX_CATEGORIES - 1]
+    return sorted(top) + [OTHER_CATEGORY]
+
+
+def as_category(series, levels):
+    values = series.astype("object").where(series.isin(levels), OTHER_CATEGORY)
+    return pd.Categorical(values, categories=levels)
+
+
+def smoothed_means(keys, values, prior):
+    stats = pd.DataFrame({"key": keys, "value": values}).groupby("key")["value"].agg(["sum", "count"])
+    return (stats["sum"] + TARGET_ENCODING_SMOOTHING * prior) / (stats["count"] + TARGET_ENCODING_SMOOTHING)
+
+
+def target_encode(ml_df, train_positions=None, folds=5, groups=None):
+    """متوسط سعر المتر لكل location/state: out-of-fold لصفوف التدريب، ومن كل التدريب للباقي"""
+    positions = np.arange(len(ml_df))
+    train = positions if train_positions is None else np.asarray(train_positions)
+    others = np.setdiff1d(positions, train)
+    price_per_m = (ml_df["price"] / ml_df["area"]).to_numpy()
+    enough = len(train) >= folds * 2
+    if groups is not None:
+        # Copies of a listing share a fold, or they would see each other's price
+        groups = np.asarray(groups)[train]
+        enough = len(np.unique(groups)) >= folds * 2
+        splitter = GroupKFold(n_splits=folds)
+    else:
+        splitter = KFold(n_splits=folds, shuffle=True, random_state=45)
+
+    encoded = {}
+    for feature, key_col in TARGET_ENCODING_KEYS.items():
+        keys = ml_df[key_col].to_numpy()
+        values = np.empty(len(ml_df))
+        # A row never sees its own price, so the encoding does not leak the target
+        splits = splitter.split(train, groups=groups) if enough else []
+        for fit_idx, apply_idx in splits:
+            prior = price_per_m[train[fit_idx]].mean()
+            means = smoothed_means(keys[train[fit_idx]], price_per_m[train[fit_idx]], prior)
+            values[train[apply_idx]] = pd.Series(keys[train[apply_idx]]).map(means).fillna(prior).to_numpy()
+        prior = price_per_m[train].mean()
+        means = smoothed_means(keys[train], price_per_m[train], prior)
+        rest = others if enough else positions
+        values[rest] = pd.Series(keys[rest]).map(means).fillna(prior).to_numpy()
+        encoded[feature] = values
+    return pd.DataFrame(encoded, index=ml_df.index)
+
+
+def row_keys(ml_df, features):
+    """hash لكل إعلان من الـ features الخام + السعر، فالمكرر بياخد نفس الـ key"""
+    # Encodings shift whenever data is added, so rows are identified without them
+    raw = [c for c in features if c not in TARGET_ENCODED_FEATURES] + ["price"]
+    return pd.util.hash_pandas_object(ml_df[raw], index=False).to_numpy()
+
+
+def encoded_features(ml_df, features, train_positions, groups=None):
+    """الـ features بالـ encodings محسوبة من صفوف التدريب بس"""
+    encoded = [f for f in features if f in TARGET_ENCODED_FEATURES]
+    X = ml_df[[f for f in features if f not in encoded]]
+    if encoded:
+        X = X.assign(**target_encode(ml_df, train_positions, groups=groups)[encoded])
+    return X[features]
+
+
+class LocationFeatureTable:
+    """خصائص كل location محسوبة مرة واحدة: area intelligence + متوسط سعر المتر"""
+
+    def __init__(self, ml_df):
+        price_per_m = ml_df["price"] / ml_df["area"]
+        prior = float(price_per_m.mean())
+        frame = ml_df.assign(price_per_m=price_per_m)
+
+        by_location = frame.groupby("te_location")
+        columns = {f: by_location[f].median() for f in AREA_FEATURES if f in frame.columns}
+        columns["location_price_per_m_te"] = smoothed_means(frame["te_location"], price_per_m, prior)
+        # A location is scored with the state most of its listings are in
+        home_state = by_location["te_state"].agg(lambda s: s.mode().iloc[0])
+        state_means = smoothed_means(frame["te_state"], price_per_m, prior)
+        columns["state_price_per_m_te"] = home_state.map(state_means)
+        table = pd.DataFrame(columns)
+
+        self.columns = list(table.columns)
+        self.index = pd.Index(table.index)
+        defaults = [FEATURE_DEFAULTS.get(c, prior) for c in self.columns]
+        # Last row holds the fallback for locations never seen in training
+        self.values = np.vstack([table.to_numpy(dtype=float), np.array(defaults, dtype=float)])
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, locations):
+        codes = self.index.get_indexer(pd.Index(locations))
+        codes = np.where(codes < 0, len(self.index), codes)
+        return pd.DataFrame(self.values.take(codes, axis=0), columns=self.columns)
+
+
+def prepare_training_frame(df, areas, backend, property_map=None, categories=None, keep=()):
+    """تجهيز الـ features للتدريب (area intelligence + encoding)، والـ target encodings بتتحسب بعد الـ split"""
+    ml_df = enrich_with_area_features(df, areas)
+    for feature, key_col in TARGET_ENCODING_KEYS.items():
+        source = "location" if key_col == "te_location" else "state"
+        if source in ml_df.columns:
+            ml_df[key_col] = ml_df[source].astype("object")
+    # Raw copies of columns the caller wants back (e.g. evaluation segments)
+    kept = [f"segment_{c}" for c in keep if c in ml_df.columns]
+    for col in kept:
+        ml_df[col] = ml_df[col[len("segment_"):]].astype("object")
+
+    # Payment Method Encoding
+    if "payment_method" in ml_df.columns:
+        ml_df["payment_code"] = ml_df["payment_method"].map(PAYMENT_CODES).fillna(0)
+
+    # Property Type Encoding, existing codes stay stable so the model can keep growing
+    property_map = dict(property_map or {})
+    if "property_type" in ml_df.columns:
+        for pt in ml_df["property_type"].dropna().unique():
+            property_map.setdefault(pt, len(property_map))
+        ml_df["property_type_code"] = ml_df["property_type"].map(property_map)
+
+    # Feature Selection
+    features = [c for c in NUMERIC_FEATURES if c in ml_df.columns]
+    encoded = [f for f, key_col in TARGET_ENCODING_KEYS.items() if key_col in ml_df.columns]
+    keys = [TARGET_ENCODING_KEYS[f] for f in encoded]
+    categories = dict(categories or {})
+    if backend.categorical:
+        for col in CATEGORICAL_FEATURES:
+            if col in ml_df.columns:
+                categories[col] = category_levels(ml_df[col], categories.get(col))
+                ml_df[col] = as_category(ml_df[col], categories[col])
+                features.append(col)
+    assert_leakage_free(features + encoded)
+
+    ml_df = ml_df[features + ["price"] + keys + kept].dropna(subset=features + keys + ["price"])
+    ml_df = ml_df[ml_df["price"] > 0]
+    if encoded and "area" in ml_df.columns:
+        ml_df = ml_df[ml_df["area"] > 0]
+        features = features + encoded
+    return ml_df, features, property_map, categories
+
+
+def location_table_for(ml_df):
+    if "te_location" not in ml_df.columns or "te_state" not in ml_df.columns:
+        return None
+    return LocationFeatureTable(ml_df)
+
+
+class FittedPriceModel:
+    """نموذج متدرب ومعاه كل اللي محتاجه عشان يتوقع"""
+
+    def __init__(self, backend, estimator, features, property_map, categories, mae, calibration=None,
+                 location_table=None):
+        self.backend = backend
+        self.estimator = estimator
+        self.features = features
+        self.property_map = property_map
+        self.categories = categories
+        self.mae = mae
+        self.calibration = np.array([]) if calibration is None else calibration
+        self.location_table = location_table
+        # Identifies this exact model, e.g. for caching its predictions
+        self.version = uuid.uuid4().hex[:12]
+
+    def frame(self, rows):
+        """features بالترتيب اللي النموذج متدرب عليه، من DataFrame أو list of dicts"""
+        rows = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        X = pd.DataFrame(index=rows.index)
+        # Location features the caller did not pass come from the precomputed table
+        # (training frames carry the raw location as te_location)
+        looked_up = None
+        location_col = next((c for c in ("te_location", "location") if c in rows.columns), None)
+        if self.location_table is not None and location_col:
+            looked_up = self.location_table.lookup(rows[location_col].astype("object"))
+            looked_up.index = rows.index
+        for f in self.features:
+            if f in rows.columns:
+                X[f] = rows[f]
+            elif looked_up is not None and f in looked_up.columns:
+                X[f] = looked_up[f]
+            elif f == "payment_code" and "payment_method" in rows.columns:
+                X[f] = rows["payment_method"].map(PAYMENT_CODES).fillna(0)
+            elif f == "property_type_code" and "property_type" in rows.columns:
+                X[f] = rows["property_type"].map(self.property_map).fillna(0)
+            else:
+                X[f] = FEATURE_DEFAULTS.get(f, 0)
+        for col, levels in self.categories.items():
+            if col in X.columns:
+                X[col] = as_category(X[col], levels)
+        return X
+
+    def predict(self, rows):
+        return self.backend.predict(self.estimator, self.frame(rows))
+
+    def predict_interval(self, rows, coverage=PREDICTION_COVERAGE):
+        """السعر المتوقع + حد أدنى وأعلى لكل الصفوف مرة واحدة"""
+        return self.backend.predict_interval(self.estimator, self.frame(rows), self.calibration, coverage)
+
+    def calibrate(self, rows, prices):
+        scores = self.backend.calibration_scores(self.estimator, self.frame(rows), prices)
+        if len(scores) > CALIBRATION_SAMPLE:
+            scores = np.random.default_rng(45).choice(scores, CALIBRATION_SAMPLE, replace=False)
+        self.calibration = scores
+
+
+def holdout_split(keys, test_size=0.2, random_state=45):
+    """train/test positions، والإعلانات المكررة (نفس الـ row key) بتفضل في ناحية واحدة"""
+    splitter = GroupShuffleSplit(n_splits=1, test_size=test_size, random_state=random_state)
+    return next(splitter.split(keys, groups=keys))
+
+
+def has_drifted(new_errors, baseline_errors):
+    """الخطأ على العقارات الجديدة أعلى من الـ held-out بأكتر من الـ tolerance وبأكتر من الصدفة"""
+    if len(new_errors) < 2 or len(baseline_errors) < 2:
+        return False
+    gap = new_errors.mean() - baseline_errors.mean()
+    noise = np.sqrt(new_errors.var(ddof=1) / len(new_errors) + baseline_errors.var(ddof=1) / len(baseline_errors))
+    return gap > MODEL_DRIFT_TOLERANCE * baseline_errors.mean() and gap > MODEL_DRIFT_Z * noise
+
+
+class IncrementalPriceModel:
+    """نموذج السعر: أول مرة بيتدرب كامل، وبعد كده بيكبر بالعقارات الجديدة بس"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
+        self.fitted = None
+        self.last_update = None  # "full", "incremental" or "unchanged", with the reason
+        self._seen = np.array([], dtype=np.uint64)  # sorted row hashes already trained on
+        self._test_keys = np.array([], dtype=np.uint64)  # sorted row hashes held out for MAE
+        self._lock = threading.Lock()
+        # One update at a time: each one reads the state the previous one published
+        self._update_lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            return self.fitted
+
+    def update(self, df, areas):
+        with self._update_lock:
+            return self._update(df, areas)
+
+    def _update(self, df, areas):
+        fitted = self.fitted
+        ml_df, features, property_map, categories = prepare_training_frame(
+            df, areas, self.backend,
+            property_map=fitted.property_map if fitted else None,
+            categories=fitted.categories if fitted else None,
+        )
+        if len(ml_df) < 50:
+            return self.last_update
+
+        keys = row_keys(ml_df, features)
+        table = location_table_for(ml_df)
+        y = ml_df["price"]
+
+        if fitted is None or features != fitted.features:
+            return self._fit_full(ml_df, keys, features, property_map, table, "initial")
+
+        is_new = ~np.isin(keys, self._seen)
+        new_count = int(is_new.sum())
+        if new_count == 0:
+            self.last_update = ("unchanged", "no new listings")
+            return self.last_update
+
+        new_fraction = new_count / len(keys)
+        if not self.backend.grows:
+            return self._fit_full(ml_df, keys, features, property_map, table, f"{self.backend.label} refits in full")
+        if new_fraction > INCREMENTAL_MAX_NEW_FRACTION:
+            return self._fit_full(ml_df, keys, features, property_map, table, f"{new_fraction:.0%} new listings")
+
+        # Drift check: the current model on listings it has never seen vs. its own held-out rows
+        held_out = np.isin(keys, self._test_keys) & ~is_new
+        scored = is_new | held_out
+        # Encoded from the rows the current model was trained on, like at serving time
+        X = encoded_features(ml_df, features, np.flatnonzero(~scored), groups=keys)
+        errors = np.abs(y[scored].to_numpy() - self.backend.predict(fitted.estimator, X[scored]))
+        new_errors, held_out_errors = errors[is_new[scored]], errors[held_out[scored]]
+        if has_drifted(new_errors, held_out_errors):
+            return self._fit_full(ml_df, keys, features, property_map, table,
+                                  f"drift (MAE {new_errors.mean():,.0f} vs {held_out_errors.mean():,.0f})")
+
+        estimator = copy.deepcopy(fitted.estimator)
+        grown = self.backend.grow(estimator, new_fraction)
+        if self.backend.size(estimator) > self.backend.max_size:
+            return self._fit_full(ml_df, keys, features, property_map, table, "model size budget reached")
+
+        # Hold out part of the new listings too, so the MAE keeps tracking fresh data
+        rng = np.random.default_rng(len(keys))
+        new_keys = np.unique(keys[is_new])
+        new_test = new_keys[rng.random(len(new_keys)) < 0.2]
+        test_keys = np.union1d(self._test_keys, new_test)
+        in_test = np.isin(keys, test_keys)
+        X = encoded_features(ml_df, features, np.flatnonzero(~in_test), groups=keys)
+
+        self.backend.fit(estimator, X[~in_test], y[~in_test])
+        predicted = self.backend.predict(estimator, X[in_test])
+        mae = mean_absolute_error(y[in_test], predicted)
+        # Only published if it beats the current model on the same held-out rows
+        current_mae = mean_absolute_error(y[in_test], self.backend.predict(fitted.estimator, X[in_test]))
+        if mae > current_mae:
+            return self._fit_full(ml_df, keys, features, property_map, table,
+                                  f"grown model worse on held-out rows (MAE {mae:,.0f} vs {current_mae:,.0f})")
+
+        refreshed = FittedPriceModel(self.backend, estimator, features, property_map, fitted.categories, mae,
+                                     location_table=table)
+        refreshed.calibrate(X[in_test], y[in_test])
+        self._publish(refreshed, keys, test_keys)
+        self.last_update = ("incremental", f"{grown} for {new_count} new listings")
+        return self.last_update
+
+    def _fit_full(self, ml_df, keys, features, property_map, location_table, reason):
+        # Duplicate listings on both sides of a random split would make the MAE optimistic
+        train, test = holdout_split(keys)
+        X, y = encoded_features(ml_df, features, train, groups=keys), ml_df["price"]
+        X_train, X_test, y_train, y_test = X.iloc[train], X.iloc[test], y.iloc[train], y.iloc[test]
+        test_keys = keys[test]
+        estimator = self.backend.build()
+        self.backend.fit(estimator, X_train, y_train)
+        predicted = self.backend.predict(estimator, X_test)
+        mae = mean_absolute_error(y_test, predicted)
+
+        categories = {c: list(X[c].cat.categories) for c in features if isinstance(X[c].dtype, pd.CategoricalDtype)}
+        fitted = FittedPriceModel(self.backend, estimator, features, property_map, categories, mae,
+                                  location_table=location_table)
+        fitted.calibrate(X_test, y_test)
+        self._publish(fitted, keys, np.unique(test_keys))
+        self.last_update = ("full", reason)
+        return self.last_update
+
+    def _publish(self, fitted, keys, test_keys):
+        # Sessions keep predicting with the old model until the new one is swapped in
+        with self._lock:
+            self.fitted = fitted
+            self._seen = np.unique(keys)
+            self._test_keys = test_keys
+
+
+def save_model(fitted, path):
+    """حفظ النموذج المتدرب في ملف (artifact) عشان يتحمل من غير تدريب"""
+    # Classes pickled as __main__.* only load back in the process that saved them
+    if type(fitted).__module__ == "__main__" or type(fitted.backend).__module__ == "__main__":
+        raise ValueError("Model classes come from __main__, import price_model instead of running it as a script")
+    with open(path, "wb") as f:
+        pickle.dump(fitted, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def check_artifact(path):
+    """بيحمّل الـ artifact في process جديد زي prediction_service.py، ويرجع الخطأ لو فيه"""
+    completed = subprocess.run(
+        [sys.executable, "-c", "import sys, price_model; price_model.load_model(sys.argv[1])", os.path.abspath(path)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+    )
+    return completed.stderr.strip().splitlines()[-1] if completed.returncode else None
+
+
+def load_model(path):
+    with open(path, "rb") as f:
+        fitted = pickle.load(f)
+    if not isinstance(fitted, FittedPriceModel):
+        raise ValueError(f"{path} is not a price model artifact")
+    return fitted
+
+
+# ========== Benchmark ==========
+def benchmark(df, areas, backends=None, latency_rows=200):
+    """مقارنة الـ backends: وقت التدريب، زمن التوقع، حجم النموذج والـ MAE"""
+    areas = area_feature_table(areas)
+    results = []
+    for name in backends or list(MODEL_BACKENDS):
+        backend = get_backend(name)
+        ml_df, features, property_map, categories = prepare_training_frame(df, areas, backend)
+        train_idx, test_idx = train_test_split(np.arange(len(ml_df)), test_size=0.2, random_state=45)
+        encoded = [f for f in TARGET_ENCODED_FEATURES if f in features]
+        ml_df[features] = encoded_features(ml_df, features, train_idx, groups=row_keys(ml_df, features))
+        train, test = ml_df.iloc[train_idx], ml_df.iloc[test_idx]
+
+        estimator = backend.build()
+        start = time.perf_counter()
+        backend.fit(estimator, train[features], train["price"])
+        fit_seconds = time.perf_counter() - start
+
+        # Intervals are calibrated on part of the held-out rows and checked on the rest
+        calibration, test = train_test_split(test, test_size=0.5, random_state=46)
+        fitted = FittedPriceModel(backend, estimator, features, property_map, categories, None,
+                                  location_table=location_table_for(train))
+        # Held-out rows get their location features from the lookup table, like Tab 3
+        calibration, test = calibration.drop(columns=encoded), test.drop(columns=encoded)
+        fitted.calibrate(calibration, calibration["price"])
+        start = time.perf_counter()
+        predicted = fitted.predict(test)
+        batch_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        _, lower, upper = fitted.predict_interval(test)
+        interval_seconds = time.perf_counter() - start
+
+        # Single-property latency, the way Tab 3 calls the model
+        single = test.head(latency_rows)
+        timings = []
+        for i in range(len(single)):
+            start = time.perf_counter()
+            fitted.predict(single.iloc[[i]])
+            timings.append(time.perf_counter() - start)
+
+        results.append({
+            "backend": name,
+            "features": len(features),
+            "fit_s": round(fit_seconds, 3),
+            "predict_ms_p50": round(np.median(timings) * 1000, 2),
+            "predict_us_per_row_batch": round(batch_seconds / len(test) * 1e6, 2),
+            "model_mb": round(len(pickle.dumps(estimator)) / 1e6, 2),
+            "mae": round(mean_absolute_error(test["price"], predicted)),
+            "mape": round(float(np.mean(np.abs(predicted - test["price"]) / test["price"])), 4),
+            "interval_us_per_row": round(interval_seconds / len(test) * 1e6, 2),
+            f"coverage_{PREDICTION_COVERAGE:.0%}": round(float(np.mean((test["price"] >= lower) & (test["price"] <= upper))), 3),
+        })
+    return pd.DataFrame(results)
+
+
+def split_indices(ml_df, scheme, folds, order=None):
+    """k-fold عشوائي، أو time split: التدريب على القديم والاختبار على الأحدث"""
+    positions = np.arange(len(ml_df))
+    if scheme == "kfold":
+        return list(KFold(n_splits=folds, shuffle=True, random_state=45).split(positions))
+    if scheme == "time":
+        # Listings are appended as they are scraped, so row order is the fallback clock
+        ordered = positions if order is None else np.argsort(order, kind="stable")
+        return [(ordered[train], ordered[test]) for train, test in TimeSeriesSplit(n_splits=folds).split(ordered)]
+    raise ValueError(f"Unknown split scheme: {scheme}")
+
+
+def error_metrics(actual, predicted):
+    actual = np.asarray(actual, dtype=float)
+    errors = np.abs(np.asarray(predicted, dtype=float) - actual)
+    return {"count": len(actual), "mae": errors.mean(), "mape": (errors / actual).mean()}
+
+
+def evaluate(df, areas, backends=None, schemes=("kfold", "time"), folds=5,
+             segments=("property_type", "state", "payment_method"), date_column=None, latency_rows=50):
+    """تقييم النموذج بـ cross-validation: الدقة لكل segment ووقت التدريب والتوقع"""
+    df = df.reset_index(drop=True)
+    areas = area_feature_table(areas)
+    date_column = date_column if date_column in df.columns else None
+    summary, by_segment = [], []
+
+    for name in backends or list(MODEL_BACKENDS):
+        backend = get_backend(name)
+        keep = tuple(segments) + ((date_column,) if date_column else ())
+        ml_df, features, property_map, categories = prepare_training_frame(df, areas, backend, keep=keep)
+        order = None
+        if date_column:
+            order = pd.to_datetime(ml_df[f"segment_{date_column}"], errors="coerce").to_numpy()
+        keys, y = row_keys(ml_df, features), ml_df["price"].to_numpy()
+
+        for scheme in schemes:
+            predicted = np.full(len(ml_df), np.nan)
+            fit_seconds, predict_seconds, single_timings = [], [], []
+            for train, test in split_indices(ml_df, scheme, folds, order):
+                # Encodings are rebuilt from the training fold only
+                X = encoded_features(ml_df, features, train, groups=keys)
+                estimator = backend.build()
+                start = time.perf_counter()
+                backend.fit(estimator, X.iloc[train], y[train])
+                fit_seconds.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                predicted[test] = backend.predict(estimator, X.iloc[test])
+                predict_seconds.append((time.perf_counter() - start) / len(test))
+
+                for i in test[:latency_rows]:
+                    start = time.perf_counter()
+                    backend.predict(estimator, X.iloc[[i]])
+                    single_timings.append(time.perf_counter() - start)
+
+            # The first time-split block is never tested, only rows with a prediction count
+            scored = ~np.isnan(predicted)
+            overall = error_metrics(y[scored], predicted[scored])
+            summary.append({
+                "backend": name,
+                "scheme": scheme,
+                "rows": overall["count"],
+                "mae": round(overall["mae"]),
+                "mape": round(overall["mape"], 4),
+                "fit_s": round(float(np.mean(fit_seconds)), 3),
+                "predict_us_per_row_batch": round(float(np.mean(predict_seconds)) * 1e6, 2),
+                "predict_ms_p50": round(float(np.median(single_timings)) * 1000, 2),
+            })
+
+            for segment in segments:
+                column = f"segment_{segment}"
+                if column not in ml_df.columns:
+                    continue
+                values = ml_df[column].to_numpy()[scored]
+                for value in pd.unique(values):
+                    mask = values == value
+                    metrics = error_metrics(y[scored][mask], predicted[scored][mask])
+                    by_segment.append({
+                        "backend": name, "scheme": scheme, "segment": segment, "value": value,
+                        "count": metrics["count"], "mae": round(metrics["mae"]), "mape": round(metrics["mape"], 4),
+                    })
+
+    segments_df = pd.DataFrame(by_segment)
+    if not segments_df.empty:
+        segments_df = segments_df.sort_values(["segment", "backend", "scheme", "count"], ascending=[True, True, True, False])
+    return pd.DataFrame(summary), segments_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Price model tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="fit a model and save it as an artifact")
+    train.add_argument("--data", default="Final1.csv")
+    train.add_argument("--areas", default="state.csv")
+    train.add_argument("--aliases", default=AREA_ALIASES_PATH, help="reviewed area-name corrections")
+    train.add_argument("--backend", choices=list(MODEL_BACKENDS))
+    train.add_argument("--out", default="price_model.pkl")
+
+    bench = commands.add_parser("benchmark", help="compare model backends on a CSV snapshot")
+    bench.add_argument("--data", default="Final1.csv")
+    bench.add_argument("--areas", default="state.csv")
+    bench.add_argument("--aliases", default=AREA_ALIASES_PATH, help="reviewed area-name corrections")
+    bench.add_argument("--backend", action="append", choices=list(MODEL_BACKENDS))
+
+    evaluation = commands.add_parser("evaluate", help="k-fold and time-split cross-validation per segment")
+    evaluation.add_argument("--data", default="Final1.csv")
+    evaluation.add_argument("--areas", default="state.csv")
+    evaluation.add_argument("--aliases", default=AREA_ALIASES_PATH, help="reviewed area-name corrections")
+    evaluation.add_argument("--backend", action="append", choices=list(MODEL_BACKENDS))
+    evaluation.add_argument("--scheme", action="append", choices=["kfold", "time"])
+    evaluation.add_argument("--folds", type=int, default=5)
+    evaluation.add_argument("--segment", action="append")
+    evaluation.add_argument("--date-column", help="orders the time split (row order otherwise)")
+    evaluation.add_argument("--top", type=int, default=10, help="segment values shown per segment")
+    evaluation.add_argument("--json", help="also write the full report to this file")
+
+    args = parser.parse_args(argv)
+    df = load_dataset(args.data)
+    area_df = load_dataset(args.areas) if args.areas and os.path.exists(args.areas) else pd.DataFrame()
+    areas = AreaFeatureTable(area_df, load_aliases(args.aliases))
+
+    if args.command == "train":
+        price_model = IncrementalPriceModel(get_backend(args.backend))
+        start = time.perf_counter()
+        price_model.update(df, areas)
+        fitted = price_model.snapshot()
+        if fitted is None:
+            print("❌ Not enough properties to train a model (need at least 50)")
+            return 1
+        save_model(fitted, args.out)
+        print(f"✅ {fitted.backend.label} trained on {len(df):,} properties in {time.perf_counter() - start:.1f}s")
+        print(f"📉 MAE: {fitted.mae:,.0f} EGP")
+        print(f"💾 Saved to {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)")
+        error = check_artifact(args.out)
+        if error:
+            print(f"❌ {args.out} does not load outside this process: {error}")
+            return 1
+        print("🔁 Artifact loads in a fresh process")
+
+    elif args.command == "benchmark":
+        print(f"📊 {len(df):,} properties from {args.data}")
+        print(benchmark(df, areas, args.backend).to_string(index=False))
+
+    elif args.command == "evaluate":
+        segments = args.segment or ["property_type", "state", "payment_method"]
+        summary, by_segment = evaluate(
+            df, areas, args.backend, args.scheme or ("kfold", "time"), args.folds, segments, args.date_column
+        )
+        print(f"📊 {len(df):,} properties from {args.data}, {args.folds} folds")
+        print(summary.to_string(index=False))
+        for segment, rows in by_segment.groupby("segment", sort=False):
+            print(f"\n🔎 Error by {segment} (top {args.top} by count)")
+            top = rows.groupby(["backend", "scheme"], sort=False).head(args.top)
+            print(top.drop(columns="segment").to_string(index=False))
+        if args.json:
+            report = {
+                "data": args.data,
+                "rows": len(df),
+                "folds": args.folds,
+                "summary": summary.to_dict(orient="records"),
+                "segments": by_segment.to_dict(orient="records"),
+            }
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            print(f"\n💾 Report written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    # Run through the imported module so pickled models reference price_model.*, not __main__.*
+    import price_model
+    sys.exit(price_model.main())
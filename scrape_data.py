@@ -3,24 +3,137 @@ import pandas as pd
 import requests
 import numpy as np
 from bs4 import BeautifulSoup
+import json
 import time
+from contextlib import contextmanager
 from datetime import datetime
 import os
 import sys
 
 
-def scrape_propertyfinder_page(page_url):
+METADATA_PATH = "scraping_metadata.txt"
+RUN_REPORT_PATH = "scrape_report.json"
+
+
+class ScrapeRunReport:
+    """تقرير التشغيل: وقت كل مرحلة وإحصائيات كل صفحة، بيتكتب JSON + scraping_metadata.txt"""
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self.stages = {}  # stage -> seconds
+        self.pages = []
+        self.counts = {}
+        self.status = "running"
+        self.error = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def new_page(self, source, url):
+        page = {
+            "source": source, "url": url, "status": None, "bytes": 0,
+            "fetch_seconds": 0.0, "parse_seconds": 0.0,
+            "cards": 0, "properties": 0, "parse_failures": 0, "error": None,
+        }
+        self.pages.append(page)
+        return page
+
+    def sources(self):
+        """ملخص الصفحات لكل موقع: العدد، الفشل، الحجم وزمن التحميل"""
+        summary = {}
+        for source in dict.fromkeys(p["source"] for p in self.pages):
+            pages = [p for p in self.pages if p["source"] == source]
+            latency = np.array([p["fetch_seconds"] for p in pages])
+            summary[source] = {
+                "pages": len(pages),
+                "failed_pages": sum(p["error"] is not None for p in pages),
+                "bytes": sum(p["bytes"] for p in pages),
+                "cards": sum(p["cards"] for p in pages),
+                "properties": sum(p["properties"] for p in pages),
+                "parse_failures": sum(p["parse_failures"] for p in pages),
+                "latency_p50": round(float(np.percentile(latency, 50)), 3),
+                "latency_p95": round(float(np.percentile(latency, 95)), 3),
+                "latency_max": round(float(latency.max()), 3),
+            }
+        return summary
+
+    def to_dict(self):
+        # Fetch and parse are summed from the pages so they add up with the other stages
+        stages = {
+            "fetch": sum(p["fetch_seconds"] for p in self.pages),
+            "parse": sum(p["parse_seconds"] for p in self.pages),
+            **self.stages,
+        }
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration_seconds": round(time.perf_counter() - self._start, 3),
+            "status": self.status,
+            "error": self.error,
+            "counts": self.counts,
+            "stages": {name: round(seconds, 3) for name, seconds in stages.items()},
+            "sources": self.sources(),
+            "pages": self.pages,
+        }
+
+    def write_json(self, path=RUN_REPORT_PATH):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def write_metadata(self, path=METADATA_PATH):
+        """الملف اللي الـ workflow بيقرا منه Net change و New properties added"""
+        report = self.to_dict()
+        counts = self.counts
+        lines = [
+            f"Last scraped: {self.started_at.strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Status: {self.status}",
+            f"Total properties: {counts.get('total_properties', 0)}",
+            f"Pages scraped: {len(self.pages)}",
+            f"Properties scraped: {counts.get('scraped', 0)}",
+            f"New properties added: {counts.get('new_properties', 0)}",
+            f"Net change: {counts.get('net_change', 0):+d}",
+            f"Duration: {report['duration_seconds']:.1f}s",
+        ]
+        lines += [f"Stage {name}: {seconds:.2f}s" for name, seconds in report["stages"].items()]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def timed_get(page, headers):
+    """تحميل الصفحة وتسجيل الـ status والحجم والوقت في إحصائيات الصفحة"""
+    start = time.perf_counter()
+    try:
+        response = requests.get(page["url"], headers=headers, timeout=10)
+        page["status"] = response.status_code
+        page["bytes"] = len(response.content)
+        response.raise_for_status()
+        return response
+    finally:
+        page["fetch_seconds"] = round(time.perf_counter() - start, 3)
+
+
+def scrape_propertyfinder_page(page_url, report=None):
     """دالة لجمع البيانات من صفحة واحدة في PropertyFinder"""
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
     }
 
+    page = (report or ScrapeRunReport()).new_page("PropertyFinder", page_url)
     try:
-        response = requests.get(page_url, headers=headers, timeout=10)
-        response.raise_for_status()
+        response = timed_get(page, headers)
+        parse_start = time.perf_counter()
         soup = BeautifulSoup(response.content, "html.parser")
     except Exception as e:
         print(f"خطأ في تحميل صفحة PropertyFinder {page_url}: {e}")
+        page["error"] = str(e)[:200]
         return []
 
     def text_or_none(selector, parent):
@@ -95,23 +208,29 @@ def scrape_propertyfinder_page(page_url):
             )
         except Exception as e:
             print(f"خطأ في معالجة كارد PropertyFinder: {e}")
+            page["parse_failures"] += 1
             continue
 
+    page["cards"] = len(property_cards)
+    page["properties"] = len(properties)
+    page["parse_seconds"] = round(time.perf_counter() - parse_start, 3)
     return properties
 
 
-def scrape_bayut_page(page_url):
+def scrape_bayut_page(page_url, report=None):
     """دالة لجمع البيانات من صفحة واحدة في Bayut"""
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
     }
 
+    page = (report or ScrapeRunReport()).new_page("Bayut", page_url)
     try:
-        response = requests.get(page_url, headers=headers, timeout=10)
-        response.raise_for_status()
+        response = timed_get(page, headers)
+        parse_start = time.perf_counter()
         soup = BeautifulSoup(response.content, "html.parser")
     except Exception as e:
         print(f"خطأ في تحميل صفحة Bayut {page_url}: {e}")
+        page["error"] = str(e)[:200]
         return []
 
     def text_or_none(selector, parent):
@@ -181,18 +300,22 @@ def scrape_bayut_page(page_url):
             )
         except Exception as e:
             print(f"خطأ في معالجة كارد Bayut: {e}")
+            page["parse_failures"] += 1
             continue
 
+    page["cards"] = len(property_cards)
+    page["properties"] = len(properties)
+    page["parse_seconds"] = round(time.perf_counter() - parse_start, 3)
     return properties
 
 
-def scrape_all_propertyfinder_pages(base_url, max_pages=3):
+def scrape_all_propertyfinder_pages(base_url, max_pages=3, report=None):
     """دالة لجمع البيانات من جميع صفحات PropertyFinder"""
     all_properties = []
 
     # الصفحة الأولى
     print(f"جاري جمع البيانات من PropertyFinder الصفحة 1...")
-    page1_properties = scrape_propertyfinder_page(base_url)
+    page1_properties = scrape_propertyfinder_page(base_url, report)
     all_properties.extend(page1_properties)
     print(f"تم جمع {len(page1_properties)} عقار من PropertyFinder الصفحة 1")
 
@@ -201,7 +324,7 @@ def scrape_all_propertyfinder_pages(base_url, max_pages=3):
         page_url = f"{base_url}page={page_num}"
         print(f"جاري جمع البيانات من PropertyFinder الصفحة {page_num}...")
 
-        properties = scrape_propertyfinder_page(page_url)
+        properties = scrape_propertyfinder_page(page_url, report)
 
         # إذا لم نجد عقارات في هذه الصفحة، توقف
         if not properties:
@@ -219,13 +342,13 @@ def scrape_all_propertyfinder_pages(base_url, max_pages=3):
     return all_properties
 
 
-def scrape_all_bayut_pages(base_url, max_pages=40):
+def scrape_all_bayut_pages(base_url, max_pages=40, report=None):
     """دالة لجمع البيانات من جميع صفحات Bayut"""
     all_properties = []
 
     # الصفحة الأولى
     print(f"جاري جمع البيانات من Bayut الصفحة 1...")
-    page1_properties = scrape_bayut_page(base_url)
+    page1_properties = scrape_bayut_page(base_url, report)
     all_properties.extend(page1_properties)
     print(f"تم جمع {len(page1_properties)} عقار من Bayut الصفحة 1")
 
@@ -234,7 +357,7 @@ def scrape_all_bayut_pages(base_url, max_pages=40):
         page_url = f"{base_url.rstrip('/')}/page-{page_num}/"
         print(f"جاري جمع البيانات من Bayut الصفحة {page_num}...")
 
-        properties = scrape_bayut_page(page_url)
+        properties = scrape_bayut_page(page_url, report)
 
         # إذا لم نجد عقارات في هذه الصفحة، توقف
         if not properties:
@@ -460,9 +583,12 @@ def clean_data_step2(df_clean):
         return df_clean
 
 
-def process_and_save_data(df_raw, output_path):
+def process_and_save_data(df_raw, output_path, report=None):
     """معالجة وحفظ البيانات"""
     print("🔄 بدء معالجة البيانات...")
+    report = report or ScrapeRunReport()
+    report.counts["scraped"] = len(df_raw)
+    clean_start = time.perf_counter()
 
     # المرحلة الأولى من التنظيف
     df_clean_1 = clean_data_step1(df_raw.copy())
@@ -498,6 +624,9 @@ def process_and_save_data(df_raw, output_path):
             ) & (df_clean["Down_Payment"].astype(str).str.strip() != "")
             df_clean.loc[mask_installments, "Payment_Method"] = "Installments"
 
+    report.add_time("clean_step1", time.perf_counter() - clean_start)
+    clean_start = time.perf_counter()
+
     # المرحلة الثانية من التنظيف
     df_clean = clean_data_step2(df_clean)
     df_clean = df_clean.drop(columns=["Location_4", "Location_3"])
@@ -508,6 +637,8 @@ def process_and_save_data(df_raw, output_path):
     for col in important_columns:
         if col in df_clean.columns:
             df_clean = df_clean[df_clean[col].notna()]
+    report.add_time("clean_step2", time.perf_counter() - clean_start)
+    report.counts["cleaned"] = len(df_clean)
 
     # عرض عينة
     print("\n🔍 عينة من البيانات بعد التنظيف النهائي:")
@@ -521,51 +652,68 @@ def process_and_save_data(df_raw, output_path):
         )
 
     # قراءة البيانات القديمة إذا وجدت
+    previous_links = set()
+    df_out = df_clean
     if os.path.exists(output_path):
         try:
-            df_final = pd.read_csv(output_path)
-            print(f"📁 تم العثور على بيانات موجودة: {len(df_final)} عقار")
-
-            # دمج البيانات
-            df_combined = pd.concat([df_final, df_clean], ignore_index=True)
-
-            # إزالة التكرارات بناءً على الرابط
-            if "Link" in df_combined.columns:
-                initial_combined = len(df_combined)
-                df_combined = df_combined.drop_duplicates(subset=["Link"], keep="last")
-
-                df_combined = df_combined.drop(
-                    columns=["Location_4", "Location_3", "Scrape_Date", "Source"],
-                    errors="ignore",
-                )
-                df_combined = df_combined.dropna()
-                df_combined = df_combined.reset_index(drop=True)
-                df_combined = df_combined.astype({'Bedrooms': 'int' , 'Down_Payment': 'int' , 'Bathrooms': 'int'})
-                duplicates_removed = initial_combined - len(df_combined)
-                if duplicates_removed > 0:
-                    print(f"🔄 تمت إزالة {duplicates_removed} عقار مكرر")
+            with report.stage("merge"):
+                df_final = pd.read_csv(output_path)
+                print(f"📁 تم العثور على بيانات موجودة: {len(df_final)} عقار")
+                report.counts["previous_properties"] = len(df_final)
+                if "Link" in df_final.columns:
+                    previous_links = set(df_final["Link"])
+
+                # دمج البيانات
+                df_combined = pd.concat([df_final, df_clean], ignore_index=True)
+
+                # إزالة التكرارات بناءً على الرابط
+                if "Link" in df_combined.columns:
+                    initial_combined = len(df_combined)
+                    df_combined = df_combined.drop_duplicates(subset=["Link"], keep="last")
+
+                    df_combined = df_combined.drop(
+                        columns=["Location_4", "Location_3", "Scrape_Date", "Source"],
+                        errors="ignore",
+                    )
+                    df_combined = df_combined.dropna()
+                    df_combined = df_combined.reset_index(drop=True)
+                    df_combined = df_combined.astype({'Bedrooms': 'int' , 'Down_Payment': 'int' , 'Bathrooms': 'int'})
+                    duplicates_removed = initial_combined - len(df_combined)
+                    if duplicates_removed > 0:
+                        print(f"🔄 تمت إزالة {duplicates_removed} عقار مكرر")
 
             # حفظ البيانات
-            df_combined.to_csv(output_path, index=False)
+            with report.stage("write"):
+                df_combined.to_csv(output_path, index=False)
+            df_out = df_combined
             print(f"💾 تم حفظ {len(df_combined)} عقار في {output_path}")
-            print(
-                f"📈 التغيير الصافي: {len(df_clean) - duplicates_removed:+d} عقار جديد"
-            )
 
         except Exception as e:
             print(f"⚠️ خطأ في قراءة/حفظ البيانات القديمة: {e}")
             # حفظ البيانات الجديدة فقط
-            df_clean.to_csv(output_path, index=False)
+            with report.stage("write"):
+                df_clean.to_csv(output_path, index=False)
             print(f"💾 تم حفظ {len(df_clean)} عقار في {output_path} (ملف جديد)")
     else:
         # حفظ البيانات الجديدة
-        df_clean.to_csv(output_path, index=False)
+        with report.stage("write"):
+            df_clean.to_csv(output_path, index=False)
         print(f"💾 تم حفظ {len(df_clean)} عقار في {output_path} (ملف جديد)")
 
+    # A rewrite that lost rows shows up as a negative net change, the workflow restores the backup then
+    previous = report.counts.get("previous_properties", 0)
+    new_links = set(df_out["Link"]) - previous_links if "Link" in df_out.columns else set()
+    report.counts.update(
+        total_properties=len(df_out),
+        new_properties=len(new_links),
+        net_change=len(df_out) - previous,
+    )
+    print(f"📈 التغيير الصافي: {len(df_out) - previous:+d} عقار ({len(new_links)} عقار جديد)")
+
     return df_clean
 
 
-def main():
+def run_scrape(report, output_path):
     """الدالة الرئيسية"""
     print("🚀 بدء جمع بيانات العقارات من كلا الموقعين")
     print("=" * 50)
@@ -579,18 +727,19 @@ def main():
 
     propertyfinder_pages = 40
     bayut_pages = 40
-    output_path = "Final1.csv"
 
     # جمع البيانات من PropertyFinder
     print(f"\n📥 جاري جمع البيانات من PropertyFinder ({propertyfinder_pages} صفحات)...")
-    propertyfinder_properties = scrape_all_propertyfinder_pages(
-        propertyfinder_url, max_pages=propertyfinder_pages
-    )
+    with report.stage("scrape_propertyfinder"):
+        propertyfinder_properties = scrape_all_propertyfinder_pages(
+            propertyfinder_url, max_pages=propertyfinder_pages, report=report
+        )
     print(f"✅ تم جمع {len(propertyfinder_properties)} عقار من PropertyFinder")
 
     # جمع البيانات من Bayut
     print(f"\n📥 جاري جمع البيانات من Bayut ({bayut_pages} صفحات)...")
-    bayut_properties = scrape_all_bayut_pages(bayut_url, max_pages=bayut_pages)
+    with report.stage("scrape_bayut"):
+        bayut_properties = scrape_all_bayut_pages(bayut_url, max_pages=bayut_pages, report=report)
     print(f"✅ تم جمع {len(bayut_properties)} عقار من Bayut")
 
     # دمج البيانات
@@ -598,6 +747,7 @@ def main():
 
     if not all_properties:
         print("❌ لم يتم جمع أي عقارات!")
+        report.status = "no_data"
         return False
 
     # تحويل إلى DataFrame
@@ -607,7 +757,7 @@ def main():
     print(f"  - Bayut: {len(bayut_properties)} عقار")
 
     # معالجة وحفظ البيانات
-    df_final = process_and_save_data(df_raw, output_path)
+    df_final = process_and_save_data(df_raw, output_path, report)
 
     # عرض ملخص
     print("\n" + "=" * 50)
@@ -638,9 +788,34 @@ def main():
         if "Area" in df_final.columns:
             print(f"  - متوسط المساحة: {df_final['Area'].mean():.0f} m²")
 
+    report.status = "ok"
     return True
 
 
+def count_rows(path):
+    try:
+        return len(pd.read_csv(path))
+    except Exception:
+        return 0
+
+
+def main(output_path="Final1.csv"):
+    """تشغيل الـ scraper وكتابة التقرير حتى لو التشغيل فشل"""
+    report = ScrapeRunReport()
+    try:
+        return run_scrape(report, output_path)
+    except BaseException as e:
+        report.status = "interrupted" if isinstance(e, KeyboardInterrupt) else "failed"
+        report.error = str(e)[:500]
+        raise
+    finally:
+        # Nothing was written, so the file on disk is still the total
+        report.counts.setdefault("total_properties", count_rows(output_path))
+        report.write_json(RUN_REPORT_PATH)
+        report.write_metadata(METADATA_PATH)
+        print(f"🧾 تقرير التشغيل: {RUN_REPORT_PATH} و {METADATA_PATH}")
+
+
 if __name__ == "__main__":
     try:
         success = main()